@@ -26,6 +26,8 @@ def create_app():
     log_init()
     # 初始化跨域策略配置
     CORS(the_app, supports_credentials=True)
+    # 加载并预热定位模型, 每个worker持有一个共享实例
+    locator.init()
 
     return the_app
 
@@ -8,6 +8,8 @@ class ErrorCode(Enum):
     """
     # ROI Extract相关
     DEFAULT_ROI_EXTRACT = (1000, "ROI Extract Error")
+    BLANK_IMAGE = (1001, "Blank Image")
+    NOT_ESSAY = (1002, "Not An Essay Image")
 
     # Image Enhance相关
     DEFAULT_IMAGE_ENHANCE = (2000, "Image Enhance Error")
@@ -0,0 +1,45 @@
+import threading
+from collections import deque
+
+import numpy as np
+
+"""
+metrics.py 进程内的轻量指标统计, 用于通过接口观察各模块的运行情况
+"""
+
+
+class Stats:
+    """
+    Stats 线程安全的数值统计
+    记录累计次数与总和, 并保留最近window个样本用于计算分位数
+    """
+
+    def __init__(self, window: int = 1024):
+        self._lock = threading.Lock()
+        self._recent = deque(maxlen=window)
+        self.count = 0
+        self.total = 0.0
+
+    def observe(self, value: float) -> None:
+        """记录一个样本"""
+        with self._lock:
+            self._recent.append(value)
+            self.count += 1
+            self.total += value
+
+    def to_dict(self) -> dict:
+        """导出统计结果, 分位数基于最近的样本"""
+        with self._lock:
+            recent = np.array(self._recent, dtype=np.float64)
+            count, total = self.count, self.total
+        if recent.size == 0:
+            return {"count": count, "mean": 0.0}
+        p50, p95, p99 = np.percentile(recent, [50, 95, 99])
+        return {
+            "count": count,
+            "mean": total / count,
+            "max": float(recent.max()),
+            "p50": float(p50),
+            "p95": float(p95),
+            "p99": float(p99),
+        }
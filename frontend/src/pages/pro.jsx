@@ -9,6 +9,7 @@ export default function ProPage() {
     const [uploadedFiles, setUploadedFiles] = useState([]);
     const [currentStep, setCurrentStep] = useState('upload'); // upload -> locate -> process -> ocr -> result
     const [locateResults, setLocateResults] = useState([]);
+    const [rejectedPages, setRejectedPages] = useState([]); // 预检未通过的图片及原因
     const [processResults, setProcessResults] = useState([]);
     const [ocrResults, setOcrResults] = useState({title: '', content: ''});
     const [finalResults, setFinalResults] = useState([]);
@@ -16,8 +17,15 @@ export default function ProPage() {
 
     // 处理上传成功
     const handleUploadSuccess = async (files, results) => {
+        // 预检未通过的图片在定位结果中class为null, 没有切割图片, 只展示原因, 不送往后续步骤
+        const items = results || [];
+        const rejected = items.filter(item => item.class == null).map(item => ({
+            name: files[item.page]?.name || `第${item.page + 1}张图片`,
+            msg: item.msg
+        }));
         setUploadedFiles(files);
-        setLocateResults(results);
+        setRejectedPages(rejected);
+        setLocateResults(items.filter(item => item.class != null));
         setCurrentStep('locate');
     };
 
@@ -75,14 +83,15 @@ export default function ProPage() {
     };
 
     const fetchProcessResults = async (locateResults) => {
-        const data = {images: locateResults.map(item => item.image)};
+        // 处理结果为二值图, 使用1位深png代替jpg, 体积更小且没有压缩伪影
+        const data = {images: locateResults.map(item => item.image), format: 'png'};
         const resp = await Post(BaseURL + '/process', {body: data})
         return resp.map((processedImage, index) => {
             return {
                 image: processedImage,  // 使用处理后的图像
                 class: locateResults[index].class  // 保留原始分类
             };
-        });
+        }).filter(item => item.image);  // 处理失败的图片为null, 跳过
     };
 
     const fetchOcrResults = async (processResults) => {
@@ -174,6 +183,17 @@ export default function ProPage() {
                         </>
                     )}
 
+                    {currentStep === 'locate' && rejectedPages.length > 0 && (
+                        <div className="mb-4 w-full rounded-lg bg-red-50 p-3 text-sm text-red-600">
+                            <p className="font-medium mb-1">以下图片未通过检查, 已跳过:</p>
+                            <ul className="list-disc pl-5 space-y-1">
+                                {rejectedPages.map((item, index) => (
+                                    <li key={index}>{item.name}: {item.msg}</li>
+                                ))}
+                            </ul>
+                        </div>
+                    )}
+
                     {['locate', 'process', 'result'].includes(currentStep) && (
                         <div className="h-full min-h-[400px]">
                             <ImageDisplay
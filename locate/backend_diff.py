@@ -0,0 +1,71 @@
+import json
+from pathlib import Path
+
+from diff import AdvancedEvaluator
+from pareto import serving_sizes
+
+"""
+backend_diff.py 比较PyTorch与ONNX Runtime(含INT8量化)推理后端在CPU上的精度与耗时差异
+需先运行export.py导出ONNX模型, 在线上CPU级联配置中该权重使用的每个输入尺寸下分别对比
+"""
+
+# 配置参数
+WEIGHT = "./resource/weights/200e4b1440sz-n.pt"
+BACKENDS = {
+    "torch": ".pt",
+    "onnx": ".onnx",
+    "onnx-int8": "-int8.onnx",
+}
+DEVICE = "cpu"
+SIZES = serving_sizes(DEVICE, WEIGHT)  # 线上CPU级联配置中该权重的输入尺寸
+METRICS_FILE = "../asset/locator/diff/backend_metrics.json"
+
+
+def summarize(stats):
+    """从评估统计中提取对比用的指标"""
+    correct = stats['correct_detections']
+    return {
+        'recall': correct / (correct + stats['false_negatives'] + 1e-6),
+        'precision': correct / (correct + stats['false_positives'] + 1e-6),
+        'avg_iou': stats['avg_iou'],
+        'avg_conf': stats['avg_conf'],
+        'inference_time': stats['inference_time'],
+    }
+
+
+def run_comparison():
+    """在每个输入尺寸下依次评估各后端, 以同尺寸的PyTorch为基准计算差异"""
+    evaluator = AdvancedEvaluator()
+    base = Path(WEIGHT).with_suffix('')
+    report = {}
+    for imgsz in SIZES:
+        tier = report[str(imgsz)] = {}
+        for backend, suffix in BACKENDS.items():
+            weight = f"{base}{suffix}"
+            if not Path(weight).exists():
+                print(f"⚠️ 跳过 {backend}: 权重不存在 {weight}")
+                continue
+            tier[backend] = summarize(evaluator.evaluate_model(weight, imgsz, device=DEVICE))
+
+        baseline = tier.get("torch")
+        if baseline is not None:
+            for backend, metrics in tier.items():
+                metrics['delta'] = {k: metrics[k] - baseline[k] for k in
+                                    ('recall', 'precision', 'avg_iou', 'avg_conf')}
+                metrics['speedup'] = baseline['inference_time'] / (metrics['inference_time'] + 1e-6)
+
+    with open(METRICS_FILE, 'w') as f:
+        json.dump(report, f, indent=2)
+    return report
+
+
+if __name__ == "__main__":
+    results = run_comparison()
+
+    for imgsz, tier in results.items():
+        print(f"\n=== 后端对比 ({Path(WEIGHT).stem} @ {imgsz}px, {DEVICE}) ===")
+        print(f"{'后端':<12}{'召回率':>10}{'精确率':>10}{'平均IoU':>10}{'耗时(s)':>10}{'加速比':>8}")
+        for name, m in tier.items():
+            print(f"{name:<12}{m['recall']:>10.2%}{m['precision']:>10.2%}{m['avg_iou']:>10.3f}"
+                  f"{m['inference_time']:>10.3f}{m.get('speedup', 1):>8.2f}")
+    print(f"📁 对比结果已保存至: {METRICS_FILE}")
@@ -0,0 +1,115 @@
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Callable, List
+
+from common.metrics import Stats
+
+"""
+batcher.py 跨请求的动态批处理器
+并发请求的图片进入同一队列, 由单个推理线程按最大批大小或最长等待时间合并为一次批量推理
+"""
+
+
+class MicroBatcher:
+    """
+    MicroBatcher 动态批处理器
+    提供与Locator.locate_batch一致的调用方式, 调用方阻塞等待自己图片的结果
+    """
+
+    def __init__(self, infer: Callable[[List], List], max_batch: int, max_wait: float, max_queue: int):
+        """
+        :param infer: 批量推理函数, 输入图片列表, 按相同顺序返回结果列表
+        :param max_batch: 单次推理的最大图片数
+        :param max_wait: 凑批时最长等待时间(秒), 从取到批内第一张图片开始计算
+        :param max_queue: 队列允许积压的最大图片数, 超出时拒绝新请求
+        """
+        self.infer = infer
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.queue = queue.Queue(maxsize=max_queue)
+        # 指标: 批大小, 排队等待时间(秒), 推理时间(秒), 取批时的队列深度
+        self.batch_size = Stats()
+        self.wait_time = Stats()
+        self.infer_time = Stats()
+        self.queue_depth = Stats()
+        self.rejected = 0
+        self._lock = threading.Lock()
+        self.thread = threading.Thread(target=self._loop, name="locate-batcher", daemon=True)
+        self.thread.start()
+
+    def submit(self, images: List) -> List[Future]:
+        """将图片加入队列, 返回与图片一一对应的Future"""
+        futures = []
+        for image in images:
+            future = Future()
+            try:
+                self.queue.put_nowait((image, future, time.monotonic()))
+            except queue.Full:
+                with self._lock:
+                    self.rejected += 1
+                # 已入队的图片照常推理, 结果由调用方丢弃
+                raise RuntimeError("定位队列已满, 请稍后重试")
+            futures.append(future)
+        return futures
+
+    def locate_batch(self, images: List) -> List:
+        """提交图片并等待全部结果, 结果顺序与输入一致"""
+        return [future.result() for future in self.submit(images)]
+
+    def _collect(self) -> List:
+        """阻塞取出第一张图片, 再在等待时间内尽量凑满一批"""
+        batch = [self.queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self.queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self, batch: List) -> None:
+        """执行一次批量推理并设置每个调用方的结果"""
+        images = [image for image, _, _ in batch]
+        try:
+            results = self.infer(images)
+        except Exception as e:
+            if len(batch) == 1:
+                batch[0][1].set_exception(e)
+                return
+            # 批量失败时逐张重试, 避免单张异常图片拖垮同批的其它请求
+            logging.error(f"批量推理失败, 逐张重试: {e}")
+            for item in batch:
+                self._run([item])
+            return
+        for (_, future, _), result in zip(batch, results):
+            future.set_result(result)
+
+    def _loop(self):
+        while True:
+            batch = self._collect()
+            start = time.monotonic()
+            self.queue_depth.observe(self.queue.qsize())
+            self.batch_size.observe(len(batch))
+            for _, _, enqueued in batch:
+                self.wait_time.observe(start - enqueued)
+            self._run(batch)
+            self.infer_time.observe(time.monotonic() - start)
+
+    def metrics(self) -> dict:
+        """导出批处理相关指标, 用于权衡吞吐与尾延迟"""
+        return {
+            "max_batch": self.max_batch,
+            "max_wait": self.max_wait,
+            "queue_size": self.queue.qsize(),
+            "rejected": self.rejected,
+            "batch_size": self.batch_size.to_dict(),
+            "wait_time": self.wait_time.to_dict(),
+            "infer_time": self.infer_time.to_dict(),
+            "queue_depth": self.queue_depth.to_dict(),
+        }
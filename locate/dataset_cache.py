@@ -0,0 +1,179 @@
+import json
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+"""
+dataset_cache.py 预解码数据集缓存
+一次性将数据集图片解码并按各基准尺寸等比缩放(长边等于尺寸)后写入内存映射数组, 标注写入紧凑的附属文件,
+并以图片名建立索引, train.py / val.py / diff.py 直接切片读取, 不再重复解码JPEG
+缩放的取整与插值方式与ultralytics的LetterBox一致, letterbox的填充仍由ultralytics完成, 推理结果与读取原图逐像素相同
+缓存文件:
+    {split}_{size}.npy      (N, size, size, 3) uint8, 缩放后的BGR图片放在左上角
+    {split}_labels.npz      原图尺寸、各尺寸缩放后的尺寸、标注框(YOLO归一化xywh)及每张图片标注的起止偏移
+    {split}_index.json      图片名 -> 行号, 以及用于判断缓存是否过期的图片文件键
+"""
+
+# 配置参数
+DATASET_DIR = "./resource/dataset/"
+CACHE_DIR = "./resource/dataset/cache/"
+SPLITS = ["train", "val"]
+SIZES = [640, 800, 1440]  # 与diff.py的IMAGE_SIZES保持一致
+READERS = 8  # 解码图片的线程数
+
+
+def image_key(img_file):
+    """图片文件键(大小与修改时间), 图片被替换后缓存对应条目失效"""
+    stat = Path(img_file).stat()
+    return f"{stat.st_size}_{stat.st_mtime_ns}"
+
+
+def resized_shape(h, w, size):
+    """等比缩放到长边为size后的(h, w), 取整方式与ultralytics的LetterBox一致"""
+    r = min(size / h, size / w)
+    return int(round(h * r)), int(round(w * r))
+
+
+def resize(img, size, out):
+    """将图片等比缩放到长边为size, 写入out的左上角, 返回缩放后的(h, w)"""
+    h, w = resized_shape(*img.shape[:2], size)
+    out[:h, :w] = img if (h, w) == img.shape[:2] else cv2.resize(img, (w, h), interpolation=cv2.INTER_LINEAR)
+    return h, w
+
+
+def read_labels(label_file):
+    """读取YOLO标注, 返回类别(M,)与归一化xywh(M, 4)"""
+    if not label_file.exists():
+        return np.zeros(0, np.int64), np.zeros((0, 4), np.float32)
+    rows = [line.split() for line in label_file.read_text().splitlines()]
+    rows = [row for row in rows if len(row) >= 5]
+    return (np.array([int(row[0]) for row in rows], np.int64),
+            np.array([list(map(float, row[1:5])) for row in rows], np.float32).reshape(-1, 4))
+
+
+def build(split, sizes=SIZES, dataset_dir=DATASET_DIR, cache_dir=CACHE_DIR):
+    """解码split下的全部图片, 写入各尺寸的内存映射数组、标注附属文件与索引"""
+    image_dir = Path(dataset_dir) / split / "images"
+    label_dir = Path(dataset_dir) / split / "labels"
+    images = sorted(p for ext in ("*.jpg", "*.jpeg", "*.png") for p in image_dir.glob(ext))
+    if not images:
+        print(f"⚠️ {split}: 没有找到图片 {image_dir.absolute()}")
+        return
+    out_dir = Path(cache_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+
+    arrays = {size: np.lib.format.open_memmap(out_dir / f"{split}_{size}.npy", mode="w+", dtype=np.uint8,
+                                              shape=(len(images), size, size, 3)) for size in sizes}
+    shapes = np.zeros((len(images), 2), np.int32)
+    resized = {size: np.zeros((len(images), 2), np.int32) for size in sizes}
+
+    def decode(i):
+        img = cv2.imread(str(images[i]))
+        if img is None:
+            raise ValueError(f"无法读取图像: {images[i]}")
+        shapes[i] = img.shape[:2]
+        for size, array in arrays.items():
+            resized[size][i] = resize(img, size, array[i])
+
+    # 每张图片只解码一次, 各尺寸直接写入内存映射
+    with ThreadPoolExecutor(max_workers=READERS) as pool:
+        list(pool.map(decode, range(len(images))))
+    for array in arrays.values():
+        array.flush()
+
+    classes, boxes, offsets = [], [], [0]
+    for img_file in images:
+        cls, xywh = read_labels(label_dir / f"{img_file.stem}.txt")
+        classes.append(cls)
+        boxes.append(xywh)
+        offsets.append(offsets[-1] + len(cls))
+    np.savez(out_dir / f"{split}_labels.npz", shapes=shapes, offsets=np.array(offsets, np.int64),
+             classes=np.concatenate(classes), boxes=np.concatenate(boxes),
+             **{f"resized_{size}": hw for size, hw in resized.items()})
+
+    index = {
+        "sizes": list(sizes),
+        "stems": {img_file.stem: i for i, img_file in enumerate(images)},
+        "keys": [image_key(img_file) for img_file in images],
+    }
+    (out_dir / f"{split}_index.json").write_text(json.dumps(index))
+    print(f"✅ {split}: 已缓存 {len(images)} 张图片, 尺寸 {list(sizes)}")
+
+
+class DatasetCache:
+    """
+    DatasetCache 预解码数据集缓存的只读视图
+    图片以只读内存映射打开, 按图片名切片不产生拷贝
+    """
+
+    def __init__(self, split, cache_dir=CACHE_DIR):
+        self.dir = Path(cache_dir)
+        self.split = split
+        index = json.loads((self.dir / f"{split}_index.json").read_text())
+        self.sizes = index["sizes"]
+        self.rows = index["stems"]
+        self.keys = index["keys"]
+        with np.load(self.dir / f"{split}_labels.npz") as labels:
+            self.shapes = labels["shapes"]
+            self.offsets = labels["offsets"]
+            self.classes = labels["classes"]
+            self.boxes = labels["boxes"]
+            self.resized = {size: labels[f"resized_{size}"] for size in self.sizes}
+        self._arrays = {}
+
+    def __getstate__(self):
+        # 传给数据加载子进程时不携带已打开的内存映射, 由子进程自行重新打开
+        state = self.__dict__.copy()
+        state["_arrays"] = {}
+        return state
+
+    @classmethod
+    def open(cls, split, cache_dir=CACHE_DIR):
+        """缓存不存在时返回None, 调用方回退为读取原图"""
+        if not (Path(cache_dir) / f"{split}_index.json").exists():
+            return None
+        return cls(split, cache_dir)
+
+    def has(self, stem, size, img_file=None):
+        """缓存中是否有该图片在该尺寸下的有效条目, 传入img_file时同时检查原图是否被修改"""
+        if size not in self.sizes or stem not in self.rows:
+            return False
+        return img_file is None or self.keys[self.rows[stem]] == image_key(img_file)
+
+    def images(self, size):
+        """(N, size, size, 3)的只读内存映射, 每张图片只有左上角的缩放尺寸范围有效"""
+        if size not in self._arrays:
+            self._arrays[size] = np.load(self.dir / f"{self.split}_{size}.npy", mmap_mode="r")
+        return self._arrays[size]
+
+    def image(self, stem, size):
+        """缩放后的图片(只读视图)"""
+        row = self.rows[stem]
+        h, w = self.resized[size][row]
+        return self.images(size)[row, :h, :w]
+
+    def shape(self, stem):
+        """原图尺寸(h, w)"""
+        return tuple(int(v) for v in self.shapes[self.rows[stem]])
+
+    def labels(self, stem):
+        """原图上的标注, 返回类别(M,)与归一化xywh(M, 4)"""
+        row = self.rows[stem]
+        start, end = self.offsets[row], self.offsets[row + 1]
+        return self.classes[start:end], self.boxes[start:end]
+
+    def to_original(self, stem, size, xyxy):
+        """将缩放后图片上的xyxy坐标映射回原图"""
+        h0, w0 = self.shape(stem)
+        h, w = self.resized[size][self.rows[stem]]
+        xyxy = np.asarray(xyxy, np.float64).reshape(-1, 4).copy()
+        xyxy[:, [0, 2]] = (xyxy[:, [0, 2]] * w0 / w).clip(0, w0)
+        xyxy[:, [1, 3]] = (xyxy[:, [1, 3]] * h0 / h).clip(0, h0)
+        return xyxy
+
+
+if __name__ == "__main__":
+    for name in SPLITS:
+        build(name)
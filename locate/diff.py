@@ -1,16 +1,25 @@
+import hashlib
 import json
+import multiprocessing
 import time
 from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 
 import cv2
 import matplotlib
 import matplotlib.pyplot as plt
 import numpy as np
+import torch
+from PIL import Image
 from ultralytics import YOLO
 
+from dataset_cache import DatasetCache
+
 """
 diff.py 比较不同模型不同输入尺寸的效果
+预测结果按(权重哈希, 输入尺寸, 图片)缓存在磁盘上, 修改评分规则后重新运行只需重新评分, 不会重复推理
+已运行dataset_cache.py时直接从预解码的内存映射读取已缩放的图片, 不再逐张解码JPEG
 """
 
 # 配置参数
@@ -23,8 +32,22 @@ MODELS = [
 IMAGE_SIZES = [640, 800, 1440]  # 需要测试的输入尺寸
 IMAGE_DIR = "./resource/dataset/train/images/"
 LABEL_DIR = "./resource/dataset/train/labels/"
+SPLIT = "train"  # IMAGE_DIR对应的数据集划分, 用于读取预解码缓存
 OUTPUT_DIR = "../asset/locator/diff/"
 METRICS_FILE = "../asset/locator/diff/model_metrics.json"
+CACHE_DIR = "../asset/locator/diff/cache/"  # 预测结果缓存目录
+BATCH = 8  # 批量推理的图片数
+WORKERS = 2  # 并行推理的进程数, 并行推理不计时
+TIMING_IMAGES = 64  # 每个配置顺序计时的图片数, 推理耗时取这些图片的平均值
+IOU_THRESHOLD = 0.7  # 判定为正确检测的IoU阈值
+
+
+def use_split(split):
+    """切换评估使用的数据集划分(train/val), 需在创建AdvancedEvaluator之前调用"""
+    global IMAGE_DIR, LABEL_DIR, SPLIT
+    IMAGE_DIR = f"./resource/dataset/{split}/images/"
+    LABEL_DIR = f"./resource/dataset/{split}/labels/"
+    SPLIT = split
 
 
 def yolo_to_xyxy(yolo_box, img_width, img_height):
@@ -52,52 +75,208 @@ def yolo_to_xyxy(yolo_box, img_width, img_height):
 
 
 def get_image_size(img_path):
-    """获取图像实际尺寸"""
-    img = cv2.imread(str(img_path))
-    if img is None:
-        raise ValueError(f"无法读取图像: {img_path}")
-    return img.shape[1], img.shape[0]  # (width, heigh
+    """只读取文件头获取图像尺寸, 与cv2.imread一致地考虑EXIF方向"""
+    try:
+        with Image.open(img_path) as img:
+            width, height = img.size
+            # EXIF方向为5~8时图像需要旋转90度, 宽高互换
+            if img.getexif().get(0x0112, 1) in (5, 6, 7, 8):
+                width, height = height, width
+    except Exception as e:
+        raise ValueError(f"无法读取图像: {img_path} {e}")
+    return width, height  # (width, height)
 
 
-def load_ground_truth():
-    """加载手动标注的真实标签"""
-    gt = {}
-    for label_file in Path(LABEL_DIR).glob("*.txt"):
+def image_files():
+    """返回同时存在标注与图片的(图片名, 图片路径)列表"""
+    files = []
+    for label_file in sorted(Path(LABEL_DIR).glob("*.txt")):
         img_file = Path(IMAGE_DIR) / f"{label_file.stem}.jpg"
-        if not img_file.exists():
-            continue
+        if img_file.exists():
+            files.append((label_file.stem, img_file))
+    return files
 
+
+def load_ground_truth():
+    """加载手动标注的真实标签, 每张图片为类别数组(N,)与坐标数组(N, 4)"""
+    gt = {}
+    for stem, img_file in image_files():
         img_width, img_height = get_image_size(img_file)
 
-        with open(label_file, 'r') as f:
-            lines = [line.strip().split() for line in f.readlines()]
+        with open(Path(LABEL_DIR) / f"{stem}.txt", 'r') as f:
+            lines = [parts for parts in (line.strip().split() for line in f.readlines()) if len(parts) >= 5]
 
-        gt[label_file.stem] = [
-            {
-                'class': int(parts[0]),
-                'xyxy': yolo_to_xyxy(list(map(float, parts[1:5])), img_width, img_height),
-                'conf': 1.0
-            }
-            for parts in lines if len(parts) >= 5
-        ]
+        gt[stem] = {
+            'class': np.array([int(parts[0]) for parts in lines], dtype=np.int64),
+            'xyxy': np.array([yolo_to_xyxy(list(map(float, parts[1:5])), img_width, img_height)
+                              for parts in lines], dtype=np.float64).reshape(-1, 4),
+        }
 
     return gt
 
 
-def calculate_iou(pred, gt):
-    """计算两个框的IoU"""
-    # 计算交集坐标
-    x1 = max(pred[0], gt[0])
-    y1 = max(pred[1], gt[1])
-    x2 = min(pred[2], gt[2])
-    y2 = min(pred[3], gt[3])
-    # 计算交集面积
-    inter_area = abs(x2 - x1) * abs(y2 - y1)
+def iou_matrix(a, b):
+    """计算两组框两两之间的IoU, a为(N, 4), b为(M, 4), 返回(N, M)"""
+    x1 = np.maximum(a[:, None, 0], b[None, :, 0])
+    y1 = np.maximum(a[:, None, 1], b[None, :, 1])
+    x2 = np.minimum(a[:, None, 2], b[None, :, 2])
+    y2 = np.minimum(a[:, None, 3], b[None, :, 3])
+    # 计算交集面积, 不相交时为0
+    inter = np.clip(x2 - x1, 0, None) * np.clip(y2 - y1, 0, None)
     # 计算并集面积
-    box1_area = (pred[2] - pred[0]) * (pred[3] - pred[1])
-    box2_area = (gt[2] - gt[0]) * (gt[3] - gt[1])
-    iou = inter_area / (box1_area + box2_area - inter_area)
-    return iou
+    area_a = (a[:, 2] - a[:, 0]) * (a[:, 3] - a[:, 1])
+    area_b = (b[:, 2] - b[:, 0]) * (b[:, 3] - b[:, 1])
+    return inter / (area_a[:, None] + area_b[None, :] - inter + 1e-9)
+
+
+def match_boxes(gt, pred):
+    """
+    按标注顺序为每个标注框贪心匹配同类别IoU最大的未匹配预测框
+    Returns:
+        (正确检测数, 漏检数, 误检数, 正确检测的IoU之和, 正确检测的置信度之和)
+    """
+    n_pred = len(pred['class'])
+    if n_pred == 0:
+        return 0, len(gt['class']), 0, 0.0, 0.0
+    ious = iou_matrix(gt['xyxy'], pred['xyxy'])
+    ious[gt['class'][:, None] != pred['class'][None, :]] = 0
+    correct, iou_sum, conf_sum = 0, 0.0, 0.0
+    for row in ious:
+        best = int(row.argmax())
+        if row[best] > IOU_THRESHOLD:
+            correct += 1
+            iou_sum += row[best]
+            conf_sum += pred['conf'][best]
+            ious[:, best] = 0  # 已匹配的预测框不再参与后续匹配
+    return correct, len(gt['class']) - correct, n_pred - correct, iou_sum, conf_sum
+
+
+def weights_hash(model_path):
+    """权重文件内容的哈希, 权重更新后缓存自动失效"""
+    digest = hashlib.sha256()
+    with open(model_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()[:16]
+
+
+def device_kind(device=None):
+    """推理设备类型(cpu/cuda), device为空时与ultralytics一致, 有GPU时使用GPU"""
+    if device is None:
+        return 'cuda' if torch.cuda.is_available() else 'cpu'
+    return 'cpu' if str(device).lower() == 'cpu' else 'cuda'
+
+
+def cache_path(model_path, imgsz, device=None):
+    """缓存按设备类型区分, 使耗时统计对应实际推理设备"""
+    return Path(CACHE_DIR) / f"{Path(model_path).name}_{weights_hash(model_path)}_{imgsz}_{device_kind(device)}.json"
+
+
+def image_key(img_file):
+    """图片缓存键, 图片被替换后缓存自动失效"""
+    stat = Path(img_file).stat()
+    return f"{stat.st_size}_{stat.st_mtime_ns}"
+
+
+def load_cache(model_path, imgsz, device=None):
+    """读取预测缓存, 返回(缓存内容, 缺失或已过期的(图片名, 图片路径)列表)"""
+    path = cache_path(model_path, imgsz, device)
+    cached = json.loads(path.read_text()) if path.exists() else {}
+    missing = [(stem, img_file) for stem, img_file in image_files()
+               if stem not in cached or cached[stem]['key'] != image_key(img_file)]
+    return cached, missing
+
+
+def load_model(model_path, imgsz, device=None):
+    model = YOLO(model_path, task='detect')
+    # 预热一次, 避免模型初始化耗时计入首批图片的推理时间
+    model.predict(source=np.zeros((imgsz, imgsz, 3), np.uint8), imgsz=imgsz, device=device, verbose=False)
+    return model
+
+
+def infer(model, dataset, chunk, imgsz, device=None):
+    """
+    批量推理chunk中的(图片名, 图片路径), 图片在计时之前解码
+    Returns:
+        ({图片名: {'key': 图片缓存键, 'boxes': [[类别, x1, y1, x2, y2, 置信度], ...]}}, 单张推理耗时)
+    """
+    # 预解码缓存中的图片已按imgsz等比缩放, 直接传入只读切片;
+    # 其余图片由cv2.imread按EXIF方向解码, 与标注坐标(get_image_size)及线上推理一致
+    pre = [dataset is not None and dataset.has(stem, imgsz, img_file) for stem, img_file in chunk]
+    sources = [dataset.image(stem, imgsz) if hit else cv2.imread(str(img_file))
+               for (stem, img_file), hit in zip(chunk, pre)]
+    start_time = time.time()
+    results = model.predict(
+        source=sources,
+        conf=0.4,
+        iou=0.5,
+        imgsz=imgsz,
+        device=device,
+        verbose=False
+    )
+    elapsed = (time.time() - start_time) / len(chunk)
+    entries = {}
+    for (stem, img_file), hit, r in zip(chunk, pre, results):
+        boxes = r.boxes
+        xyxy = boxes.xyxy.cpu().numpy()
+        if hit:
+            xyxy = dataset.to_original(stem, imgsz, xyxy)
+        entries[stem] = {
+            'key': image_key(img_file),
+            'boxes': np.concatenate([boxes.cls.cpu().numpy()[:, None], xyxy,
+                                     boxes.conf.cpu().numpy()[:, None]], axis=1).tolist(),
+        }
+    return entries, elapsed
+
+
+def write_cache(model_path, imgsz, device, cached):
+    path = cache_path(model_path, imgsz, device)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(json.dumps(cached))
+
+
+def predict_all(model_path, imgsz, device=None, timed=True):
+    """
+    获取模型在全部图片上的预测结果, 优先读取缓存, 只对缺失的图片批量推理并写回缓存
+    timed为False时(多进程并行推理)耗时受进程间争用影响, 不记录耗时, 由time_predictions顺序计时
+    Returns:
+        {图片名: {'key': 图片缓存键, 'boxes': [[类别, x1, y1, x2, y2, 置信度], ...], 'time': 单张推理耗时或None}}
+    """
+    cached, missing = load_cache(model_path, imgsz, device)
+    files = image_files()
+    if missing:
+        print(f"🔍 推理 {Path(model_path).stem}_{imgsz}: {len(missing)}/{len(files)} 张图片未缓存")
+        dataset = DatasetCache.open(SPLIT)
+        model = load_model(model_path, imgsz, device)
+        for i in range(0, len(missing), BATCH):
+            entries, elapsed = infer(model, dataset, missing[i:i + BATCH], imgsz, device)
+            for entry in entries.values():
+                entry['time'] = elapsed if timed else None
+            cached.update(entries)
+        write_cache(model_path, imgsz, device, cached)
+    return {stem: cached[stem] for stem, _ in files}
+
+
+def time_predictions(model_path, imgsz, device=None):
+    """
+    在当前进程中顺序推理, 为未计时的图片补充耗时, 直到已计时的图片达到TIMING_IMAGES张
+    调用前需已由predict_all缓存全部图片的预测结果, 返回值同predict_all
+    """
+    cached, _ = load_cache(model_path, imgsz, device)
+    files = image_files()
+    untimed = [(stem, img_file) for stem, img_file in files if cached[stem].get('time') is None]
+    need = min(len(untimed), TIMING_IMAGES - (len(files) - len(untimed)))
+    if need > 0:
+        print(f"⏱️ 计时 {Path(model_path).stem}_{imgsz}: {need} 张图片")
+        dataset = DatasetCache.open(SPLIT)
+        model = load_model(model_path, imgsz, device)
+        for i in range(0, need, BATCH):
+            chunk = untimed[i:min(i + BATCH, need)]
+            _, elapsed = infer(model, dataset, chunk, imgsz, device)
+            for stem, _ in chunk:
+                cached[stem]['time'] = elapsed
+        write_cache(model_path, imgsz, device, cached)
+    return {stem: cached[stem] for stem, _ in files}
 
 
 class AdvancedEvaluator:
@@ -105,11 +284,14 @@ class AdvancedEvaluator:
         self.gt_data = load_ground_truth()
         self.metrics = defaultdict(dict)
 
-    def evaluate_model(self, model_path, imgsz):
-        """评估单个模型在特定尺寸下的表现"""
-        model = YOLO(model_path)
+    def evaluate_model(self, model_path, imgsz, device=None):
+        """评估单个模型在特定尺寸下的表现, device为空时由ultralytics自动选择"""
+        predict_all(model_path, imgsz, device)
+        return self.score(model_path, imgsz, time_predictions(model_path, imgsz, device))
+
+    def score(self, model_path, imgsz, predictions):
+        """根据预测结果计算统计指标与综合评分, 不涉及推理"""
         model_name = f"{Path(model_path).stem}_{imgsz}"
-        print(f"\n🔍 正在评估: {model_name}")
 
         stats = {
             'total_images': 0,
@@ -120,66 +302,31 @@ class AdvancedEvaluator:
             'avg_conf': 0,
             'inference_time': 0
         }
+        timed = 0
 
-        for img_path in Path(LABEL_DIR).glob("*.txt"):
-            # 获取对应图片路径
-            img_file = Path(IMAGE_DIR) / f"{img_path.stem}.jpg"
-            if not img_file.exists():
-                continue
-
-            # 预测并计时
-            start_time = time.time()
-            results = model.predict(
-                source=str(img_file),
-                conf=0.4,
-                iou=0.5,
-                imgsz=imgsz,
-                verbose=False
-            )
-            stats['inference_time'] += time.time() - start_time
-
-            # 处理预测结果
-            gt_boxes = self.gt_data.get(img_path.stem, [])
-            pred_boxes = []
-            for r in results:
-                for box in r.boxes:
-                    pred_boxes.append({
-                        'class': int(box.cls),
-                        'xyxy': box.xyxy.tolist()[0],
-                        'conf': float(box.conf)
-                    })
+        empty = {'class': np.zeros(0, np.int64), 'xyxy': np.zeros((0, 4))}
+        for stem, prediction in predictions.items():
+            boxes = np.array(prediction['boxes'], dtype=np.float64).reshape(-1, 6)
+            pred = {'class': boxes[:, 0].astype(np.int64), 'xyxy': boxes[:, 1:5], 'conf': boxes[:, 5]}
+            correct, fn, fp, iou_sum, conf_sum = match_boxes(self.gt_data.get(stem, empty), pred)
 
             # 更新统计指标
             stats['total_images'] += 1
-            matched = set()
-
-            for gt in gt_boxes:
-                best_iou = 0
-                best_idx = -1
-
-                for i, pred in enumerate(pred_boxes):
-                    if pred['class'] == gt['class']:
-                        iou = calculate_iou(pred['xyxy'], gt['xyxy'])
-                        if iou > best_iou and i not in matched:
-                            best_iou = iou
-                            best_idx = i
-
-                if best_iou > 0.7:
-                    stats['correct_detections'] += 1
-                    stats['avg_iou'] += best_iou
-                    stats['avg_conf'] += pred_boxes[best_idx]['conf']
-                    matched.add(best_idx)
-                else:
-                    stats['false_negatives'] += 1
-
-            stats['false_positives'] += len(pred_boxes) - len(matched)
+            if prediction.get('time') is not None:
+                stats['inference_time'] += prediction['time']
+                timed += 1
+            stats['correct_detections'] += correct
+            stats['false_negatives'] += fn
+            stats['false_positives'] += fp
+            stats['avg_iou'] += float(iou_sum)
+            stats['avg_conf'] += float(conf_sum)
 
         # 计算平均值
         if stats['correct_detections'] > 0:
             stats['avg_iou'] /= stats['correct_detections']
             stats['avg_conf'] /= stats['correct_detections']
-        if stats['total_images'] > 0:
-            stats['inference_time'] /= stats['total_images']
+        if timed > 0:
+            stats['inference_time'] /= timed
 
         # 计算综合评分
         recall = stats['correct_detections'] / (stats['correct_detections'] + stats['false_negatives'] + 1e-6)
@@ -191,10 +338,24 @@ class AdvancedEvaluator:
         return stats
 
     def run_evaluation(self):
-        """执行全量评估"""
-        for model_path in MODELS:
-            for imgsz in IMAGE_SIZES:
-                self.evaluate_model(model_path, imgsz)
+        """
+        执行全量评估, 缺失预测结果的配置多进程并行推理(不计时)
+        推理耗时计入评分, 之后在主进程中逐个配置顺序计时, 各配置的耗时不受并行推理的争用影响
+        """
+        configs = [(model_path, imgsz) for model_path in MODELS for imgsz in IMAGE_SIZES]
+        todo = [(model_path, imgsz) for model_path, imgsz in configs if load_cache(model_path, imgsz)[1]]
+        if todo:
+            # spawn方式启动子进程, 避免fork后CUDA上下文不可用
+            with ProcessPoolExecutor(max_workers=WORKERS, mp_context=multiprocessing.get_context("spawn")) as pool:
+                futures = [pool.submit(predict_all, model_path, imgsz, None, WORKERS == 1)
+                           for model_path, imgsz in todo]
+                for future in futures:
+                    future.result()
+        for model_path, imgsz in configs:
+            self.score(model_path, imgsz, time_predictions(model_path, imgsz))
+        # 按配置顺序排列, 保证报告与图表的顺序稳定
+        self.metrics = {f"{Path(m).stem}_{sz}": self.metrics[f"{Path(m).stem}_{sz}"]
+                        for m in MODELS for sz in IMAGE_SIZES}
 
         # 保存结果
         with open(METRICS_FILE, 'w') as f:
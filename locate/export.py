@@ -0,0 +1,94 @@
+import os
+import random
+from pathlib import Path
+
+import cv2
+import numpy as np
+import onnx
+from onnxruntime.quantization import CalibrationDataReader, QuantFormat, QuantType, quantize_static
+from ultralytics import YOLO
+from ultralytics.data.augment import LetterBox
+
+from pareto import serving_sizes
+
+"""
+export.py 将定位器权重导出为ONNX, 并可选地使用数据集图片进行INT8静态量化
+导出结果与原权重同目录, 命名为 <权重名>.onnx 与 <权重名>-int8.onnx, 供locator.py的onnx后端使用
+ONNX模型的输入尺寸是动态的, 校准图片按线上CPU级联配置中该权重的每个输入尺寸各预处理一次, 量化参数覆盖所有线上尺寸
+"""
+
+os.environ['KMP_DUPLICATE_LIB_OK'] = 'True'
+
+# 配置参数
+WEIGHTS = [
+    "./resource/weights/200e4b1440sz-n.pt",
+]
+IMAGE_DIR = "./resource/dataset/train/images/"  # 校准图片来源
+CALIB_SIZE = 100  # 校准图片数量, 每张图片在每个线上输入尺寸下各校准一次
+INT8 = True  # 是否导出INT8量化模型
+
+
+def export_onnx(weight):
+    """导出动态输入尺寸与批大小的ONNX模型, 返回导出路径"""
+    model = YOLO(weight)
+    path = model.export(format='onnx', dynamic=True, simplify=True)
+    print(f"✅ ONNX导出成功: {path}")
+    return path, len(model.model.model) - 1
+
+
+class LetterboxCalibrationReader(CalibrationDataReader):
+    """按推理时的预处理方式读取校准图片, 每张图片按sizes中的每个输入尺寸各预处理一次"""
+
+    def __init__(self, input_name, image_paths, sizes):
+        self.input_name = input_name
+        self.letterboxes = [LetterBox(new_shape=(imgsz, imgsz), auto=False) for imgsz in sizes]
+        self.blobs = self.preprocess(image_paths)
+
+    def preprocess(self, image_paths):
+        for path in image_paths:
+            img = cv2.imread(str(path))
+            if img is None:
+                continue
+            for letterbox in self.letterboxes:
+                # BGR HWC uint8 -> RGB NCHW float32
+                blob = letterbox(image=img)[..., ::-1].transpose(2, 0, 1)[None].astype(np.float32) / 255.0
+                yield np.ascontiguousarray(blob)
+
+    def get_next(self):
+        blob = next(self.blobs, None)
+        return None if blob is None else {self.input_name: blob}
+
+
+def quantize_int8(onnx_path, head_index, sizes, image_dir=IMAGE_DIR, calib_size=CALIB_SIZE):
+    """使用数据集图片在sizes中的每个输入尺寸下校准并进行INT8静态量化, 检测头保持浮点以保证框回归精度"""
+    images = sorted(Path(image_dir).glob("*.jpg"))
+    if not images:
+        raise FileNotFoundError(f"校准图片不存在: {Path(image_dir).absolute()}")
+    random.Random(0).shuffle(images)
+
+    graph = onnx.load(onnx_path).graph
+    # 检测头(DFL解码, 坐标拼接)对量化误差敏感, 不参与量化
+    head = f"/model.{head_index}/"
+    excluded = [node.name for node in graph.node if node.name.startswith(head)]
+
+    output = str(Path(onnx_path).with_suffix('')) + "-int8.onnx"
+    quantize_static(
+        model_input=onnx_path,
+        model_output=output,
+        calibration_data_reader=LetterboxCalibrationReader(graph.input[0].name, images[:calib_size], sizes),
+        quant_format=QuantFormat.QDQ,
+        per_channel=True,
+        activation_type=QuantType.QUInt8,
+        weight_type=QuantType.QInt8,
+        nodes_to_exclude=excluded,
+    )
+    print(f"✅ INT8量化成功: {output} | 校准图片: {min(calib_size, len(images))}张 | 输入尺寸: {sizes}")
+    return output
+
+
+if __name__ == "__main__":
+    for weight in WEIGHTS:
+        path, head_index = export_onnx(weight)
+        if INT8:
+            # onnx后端只在CPU上推理, 按CPU的级联配置校准
+            quantize_int8(path, head_index, serving_sizes("cpu", weight))
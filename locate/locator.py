@@ -1,18 +1,33 @@
 import base64
+import hashlib
 import io
+import json
 import logging
 import os
-from dataclasses import dataclass
+import threading
+import time
+from collections import Counter, OrderedDict
+from dataclasses import asdict, dataclass, replace
 from datetime import datetime
+from pathlib import Path
 from typing import Tuple, List
 
 import cv2
 import numpy as np
+import torch
+from PIL import Image
 from flask import Blueprint, request, abort
 from ultralytics import YOLO
 
 from common import rex
+from common.error_code import ErrorCode
+from common.errorx import BizException as Be
+from common.metrics import Stats
 from common.rex import Response
+from locate.batcher import MicroBatcher
+from locate.precheck import check, preview
+from locate.refine import refine_box
+from locate.template import TemplateMatcher
 
 """
 locate.py 定位器的推理过程与相关flask接口定义
@@ -20,55 +35,155 @@ locate.py 定位器的推理过程与相关flask接口定义
 
 bp = Blueprint('locate', __name__)
 
-MODEL = 'locate/resource/weights/200e4b1440sz-n.pt'
-DEVICE = 0
+WEIGHTS_DIR = 'locate/resource/weights/'
+MODEL = WEIGHTS_DIR + '200e4b1440sz-n.pt'
+# 推理后端: torch 直接使用.pt权重; onnx / onnx-int8 使用export.py导出的模型, 通过ONNX Runtime在CPU上推理
+BACKEND = 'torch'
+BACKEND_SUFFIX = {'torch': '.pt', 'onnx': '.onnx', 'onnx-int8': '-int8.onnx'}
+DEVICE = 0 if BACKEND == 'torch' and torch.cuda.is_available() else 'cpu'
 IMGSZ = 800
+# 级联定位配置(权重名, 输入尺寸), 权重名取自diff.py中MODELS对应的权重; 只配置一级时即为单模型定位
+# 前一级缺少title/content或最低置信度低于CASCADE_CONF时, 交由下一级重新定位
+TIERS = [
+    ('200e4b1440sz-n', 640),
+    ('200e4b1440sz-n', 1440),
+]
+CASCADE_CONF = 0.6
+# pareto.py按设备类型(cpu/cuda)写入的级联配置, 存在时启动时覆盖TIERS
+CONFIG_FILE = 'locate/resource/locator.json'
+BATCH = 4  # 单次推理的最大批大小
+MAX_WAIT = 0.01  # 跨请求凑批的最长等待时间(秒)
+MAX_QUEUE = 64  # 等待推理的最大图片数
+# JPEG可在DCT域直接缩小解码, 检测只需要长边不小于最大输入尺寸的图片
+REDUCED_FLAGS = {2: cv2.IMREAD_REDUCED_COLOR_2, 4: cv2.IMREAD_REDUCED_COLOR_4, 8: cv2.IMREAD_REDUCED_COLOR_8}
+# 是否在原图上将检测框贴合到墨迹边缘, 使低输入尺寸的粗框也能得到准确的切割
+# 默认关闭: 开启前需在标注数据上对比开启前后切割框的IoU与召回率, 并观察/locate/metrics中refine的边缘移动量
+REFINE = False
+# 定位结果缓存的内存上限(字节)与可选的磁盘缓存目录(None表示不启用), 磁盘缓存在重启后仍然有效
+CACHE_BYTES = 16 * 1024 * 1024
+CACHE_DIR = None
+CACHE_DISK_BYTES = 256 * 1024 * 1024  # 磁盘缓存的字节上限, 超出时删除最久未使用的文件
+# 预热时使用的图片尺寸(h, w), 覆盖竖拍、横拍手机照片与正方形输入
+WARMUP_SHAPES = [(4032, 3024), (3024, 4032)]
+# 上传预检: 在EXIF缩略图或缩小解码的预览图上拒绝空白页与非作文图片, 在解码原图与级联定位之前完成
+PRECHECK = True
+# 预检的启发式判断通过后, 再用首级权重以该尺寸在预览图上推理, 未检出content时拒绝(None表示不启用)
+# 默认关闭: 该推理在请求线程中逐张串行执行, 不经过批处理器; 且尚未在val集上统计误拒率
+PRECHECK_IMGSZ = None
+# 模板模式: 同款答题纸的后续图片与已检测图片对齐成功时复用其定位框, 只有对齐失败的图片才运行模型
+TEMPLATE = False
 
 instance = None
+# 跨请求合并推理的批处理器, 与instance一同创建
+batcher: 'MicroBatcher | None' = None
+# 细化时各边坐标的变化量(像素)
+refine_moves = {edge: Stats() for edge in ("x1", "y1", "x2", "y2")}
+# 预检使用的低分辨率定位器, 独立于级联定位器加载, 由_precheck_lock串行化
+prechecker: 'Locator | None' = None
+_precheck_lock = threading.Lock()
+# 预检耗时(秒)与按错误码统计的拒绝数
+precheck_time = Stats()
+rejected = Counter()
+# 模板模式下的版面模板库与对齐耗时(秒)
+templates = TemplateMatcher()
+template_time = Stats()
+# 保证每个worker只加载一次模型
+_lock = threading.Lock()
+# 模型加载并预热完成后置位
+ready = threading.Event()
 # 解决动态链接库冲突
 os.environ['KMP_DUPLICATE_LIB_OK'] = 'True'
 
 
+def load_tiers(path: str = CONFIG_FILE) -> List[Tuple[str, int]]:
+    """读取当前设备类型对应的级联配置, 配置不存在或无效时使用默认的TIERS"""
+    kind = 'cpu' if DEVICE == 'cpu' else 'cuda'
+    try:
+        tiers = json.loads(Path(path).read_text())[kind]['tiers']
+        return [(str(name), int(imgsz)) for name, imgsz in tiers] or TIERS
+    except FileNotFoundError:
+        return TIERS
+    except Exception as e:
+        logging.error(f"读取定位器配置失败 {path}: {e}")
+        return TIERS
+
+
+TIERS = load_tiers()
+
+
+def backend_weight(weight: str, backend: str = BACKEND) -> str:
+    """根据推理后端得到对应的权重路径, 如 xxx.pt -> xxx-int8.onnx"""
+    if backend not in BACKEND_SUFFIX:
+        raise ValueError(f"不支持的推理后端: {backend}")
+    return str(Path(weight).with_suffix('')) + BACKEND_SUFFIX[backend]
+
+
 class Locator:
     def __init__(self, weight, device):
-        """初始化定位器"""
+        """初始化定位器, 后端由权重后缀决定(.pt为PyTorch, .onnx为ONNX Runtime)"""
         try:
-            self.model = YOLO(weight)
-            self.model.to(device)
+            self.model = YOLO(weight, task='detect')
+            # 导出模型没有可迁移的参数, 设备在推理时指定
+            if Path(weight).suffix == '.pt':
+                self.model.to(device)
+            self.device = device
             self.class_names = self.model.names  # 获取类别名称映射
             print(f"✅ 定位器初始化成功 | 类别: {self.class_names} | 设备: {device}")
         except Exception as e:
             raise RuntimeError(f"定位器初始化失败: {str(e)}")
 
+    def warmup(self, imgsz: int = IMGSZ):
+        """使用空白图片按服务尺寸执行预热推理, 消除首个请求的初始化开销"""
+        start = datetime.now()
+        for h, w in WARMUP_SHAPES + [(imgsz, imgsz)]:
+            blank = np.full((h, w, 3), 255, np.uint8)
+            for n in sorted({1, BATCH}):
+                self.locate_batch([blank] * n, imgsz=imgsz)
+        logging.info(f"定位器预热时间为{(datetime.now() - start)}s")
+
     def locate(self, image):
         """输入图片, 输出title和content的定位box"""
+        return self.locate_batch([image])[0]
+
+    def locate_batch(self, images: List[np.ndarray], batch: int = BATCH, imgsz: int = IMGSZ):
+        """输入图片列表, 按批推理后输出与输入顺序一致的title和content定位box列表"""
         # 参数验证
-        if not isinstance(image, np.ndarray) or image.ndim != 3:
-            raise ValueError("输入必须是3通道的numpy数组(BGR格式)")
+        for image in images:
+            if not isinstance(image, np.ndarray) or image.ndim != 3:
+                raise ValueError("输入必须是3通道的numpy数组(BGR格式)")
+        if batch < 1:
+            raise ValueError("批大小必须为正整数")
         start = datetime.now()
-        # 执行预测
-        results = self.model.predict(
-            source=image,
-            conf=0.4,
-            iou=0.45,
-            imgsz=IMGSZ,
-            verbose=False  # 关闭冗余输出
-        )
+        outputs = []
+        # 按最大批大小分批执行预测, 结果顺序与输入一致
+        for i in range(0, len(images), batch):
+            results = self.model.predict(
+                source=images[i:i + batch],
+                conf=0.4,
+                iou=0.45,
+                imgsz=imgsz,
+                device=self.device,
+                verbose=False  # 关闭冗余输出
+            )
+            outputs.extend(self.select(result) for result in results)
         end = datetime.now()
-        logging.info(f"识别时间为{(end - start)}s")
-        # 解析结果
+        logging.info(f"识别{len(images)}张图片时间为{(end - start)}s")
+        return outputs
+
+    @staticmethod
+    def select(result) -> dict[str, 'Box|None']:
+        """解析单张图片的预测结果, 选出title和content的定位box"""
         detections = []
-        for result in results:
-            for box in result.boxes:
-                xyxy = box.xyxy.cpu().numpy()[0]  # 转换为numpy数组后取第一个元素
-                detections.append(Box(
-                    c=int(box.cls),
-                    x1=float(xyxy[0]),
-                    y1=float(xyxy[1]),
-                    x2=float(xyxy[2]),
-                    y2=float(xyxy[3]),
-                    conf=float(box.conf)
-                ))
+        for box in result.boxes:
+            xyxy = box.xyxy.cpu().numpy()[0]  # 转换为numpy数组后取第一个元素
+            detections.append(Box(
+                c=int(box.cls),
+                x1=float(xyxy[0]),
+                y1=float(xyxy[1]),
+                x2=float(xyxy[2]),
+                y2=float(xyxy[3]),
+                conf=float(box.conf)
+            ))
 
         # 按类别分组并选择置信度最高的
         output: dict[str, 'Box|None'] = {"title": None, "content": None}
@@ -94,6 +209,7 @@ class Box(Response):
     x2: float  # 右下角x
     y2: float  # 右下角y
     conf: float = 0.0  # 置信度
+    tier: int = 0  # 给出该结果的级联级别, -1表示复用模板
 
     @property
     def xyxy(self) -> Tuple[float, float, float, float]:
@@ -108,6 +224,10 @@ class Box(Response):
             if self.y1 >= self.y2:
                 self.y2 = self.y1 + 10  # 最小高度保护
 
+    def scale(self, sx: float, sy: float) -> 'Box':
+        """按比例缩放坐标, 用于将缩小解码图上的框映射回原图"""
+        return replace(self, x1=self.x1 * sx, y1=self.y1 * sy, x2=self.x2 * sx, y2=self.y2 * sy)
+
     def to_dict(self):
         return {
             "c": self.c,
@@ -118,9 +238,308 @@ class Box(Response):
         }
 
 
-# 对前端传入的图片列表进行切割, 返回base64和图片类型
-def crop(imgs: List[np.ndarray], no, boxs: dict[str, 'Box|None']):
-    img = imgs[no]
+class Cascade:
+    """
+    Cascade 级联定位器
+    所有图片先经过最快的一级, 仅缺少title/content或置信度不足的图片交由下一级, 并记录最终作答的级别
+    """
+
+    def __init__(self, tiers: List[Tuple[str, int]], device):
+        """
+        :param tiers: 由快到慢的(权重路径, 输入尺寸)列表, 相同权重只加载一次
+        :param device: 推理设备
+        """
+        locators = {}
+        self.tiers: List[Tuple[Locator, int]] = []
+        for weight, imgsz in tiers:
+            if weight not in locators:
+                locators[weight] = Locator(weight, device)
+            self.tiers.append((locators[weight], imgsz))
+        self._lock = threading.Lock()
+        self.answered = [0] * len(self.tiers)  # 各级作答的图片数
+
+    def warmup(self):
+        for locator, imgsz in self.tiers:
+            locator.warmup(imgsz)
+
+    def locate(self, image):
+        return self.locate_batch([image])[0]
+
+    @staticmethod
+    def confident(located: dict[str, 'Box|None']) -> bool:
+        """title与content均被检出且最低置信度不低于阈值"""
+        return all(box is not None and box.conf >= CASCADE_CONF for box in located.values())
+
+    def locate_batch(self, images: List[np.ndarray]):
+        """逐级定位, 每一级只处理上一级不可信的图片, 结果顺序与输入一致"""
+        outputs: List['dict[str, Box|None] | None'] = [None] * len(images)
+        answered_by = [0] * len(images)
+        todo = list(range(len(images)))
+        for tier, (locator, imgsz) in enumerate(self.tiers):
+            if not todo:
+                break
+            remaining = []
+            for i, located in zip(todo, locator.locate_batch([images[i] for i in todo], imgsz=imgsz)):
+                for box in located.values():
+                    if box is not None:
+                        box.tier = tier
+                # 下一级检出的类别不少于当前结果时才采用
+                found = sum(box is not None for box in located.values())
+                if outputs[i] is None or found >= sum(box is not None for box in outputs[i].values()):
+                    outputs[i] = located
+                    answered_by[i] = tier
+                if not self.confident(located):
+                    remaining.append(i)
+            todo = remaining
+        with self._lock:
+            for tier in answered_by:
+                self.answered[tier] += 1
+        return outputs
+
+    def metrics(self) -> dict:
+        with self._lock:
+            return {
+                "tiers": [f"{name}@{imgsz}" for name, imgsz in TIERS],
+                "answered": list(self.answered),
+            }
+
+
+def tier_weights() -> List[Tuple[str, int]]:
+    """将级联配置解析为当前后端的权重路径"""
+    return [(backend_weight(f"{WEIGHTS_DIR}{name}.pt"), imgsz) for name, imgsz in TIERS]
+
+
+class LocateCache:
+    """
+    LocateCache 定位结果缓存
+    以上传图片字节、模型权重名、输入尺寸与后处理开关(REFINE/TEMPLATE)的哈希为键, 缓存原图坐标下的定位框, 命中时跳过解码与推理
+    内存层为按字节数限制的LRU, 可选的磁盘层以json文件保存, 内存未命中时回填
+    磁盘层按disk_bytes限制总大小, 启动时按修改时间载入已有文件, 命中时更新修改时间, 超出时删除最久未使用的文件;
+    多个worker共用目录时各自只统计本进程载入与写入的文件, 上限为近似值
+    """
+
+    def __init__(self, max_bytes: int, disk_dir: 'str | None' = None, disk_bytes: int = CACHE_DISK_BYTES):
+        self.max_bytes = max_bytes
+        self.disk_dir = Path(disk_dir) if disk_dir else None
+        self.disk_bytes = disk_bytes
+        self._lock = threading.Lock()
+        self._entries: OrderedDict[str, tuple[dict, int]] = OrderedDict()
+        self._files: OrderedDict[str, int] = OrderedDict()  # 磁盘层的 键 -> 文件字节数, 按最近使用排序
+        self.bytes = 0
+        self.disk_used = 0
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        if self.disk_dir:
+            self.disk_dir.mkdir(parents=True, exist_ok=True)
+            files = []
+            for path in self.disk_dir.glob("*.json"):
+                stat = path.stat()
+                files.append((stat.st_mtime, path.stem, stat.st_size))
+            for _, key, size in sorted(files):
+                self._files[key] = size
+                self.disk_used += size
+            self._unlink(self._evict_disk())
+
+    @staticmethod
+    def key(data: bytes) -> str:
+        """计算缓存键, 级联的模型、输入尺寸或后处理开关变化后旧结果自动失效"""
+        digest = hashlib.sha256(data)
+        digest.update(";".join(f"{Path(weight).name}:{imgsz}" for weight, imgsz in tier_weights()).encode())
+        digest.update(f";refine={int(REFINE)};template={int(TEMPLATE)}".encode())
+        return digest.hexdigest()
+
+    @staticmethod
+    def dumps(boxs: dict[str, 'Box|None']) -> str:
+        return json.dumps({k: asdict(box) if box else None for k, box in boxs.items()})
+
+    @staticmethod
+    def loads(text: str) -> dict[str, 'Box|None']:
+        return {k: Box(**box) if box else None for k, box in json.loads(text).items()}
+
+    def get(self, key: str) -> 'dict[str, Box|None] | None':
+        """查询缓存, 返回的定位框不应被修改"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+        path = self.disk_dir / f"{key}.json" if self.disk_dir else None
+        if path is not None and path.exists():
+            try:
+                boxs = self.loads(path.read_text())
+            except Exception as e:
+                logging.error(f"读取定位缓存失败 {path}: {e}")
+            else:
+                self._remember(key, boxs, path.stat().st_size)
+                with self._lock:
+                    self.disk_hits += 1
+                    if key in self._files:
+                        self._files.move_to_end(key)
+                try:
+                    os.utime(path)
+                except OSError:
+                    pass
+                return boxs
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, key: str, boxs: dict[str, 'Box|None']) -> None:
+        """写入缓存, 启用磁盘层时同时落盘"""
+        text = self.dumps(boxs)
+        self._remember(key, boxs, len(text))
+        if self.disk_dir:
+            try:
+                tmp = self.disk_dir / f"{key}.tmp"
+                tmp.write_text(text)
+                tmp.replace(self.disk_dir / f"{key}.json")
+            except Exception as e:
+                logging.error(f"写入定位缓存失败 {key}: {e}")
+                return
+            size = len(text.encode())
+            with self._lock:
+                self.disk_used += size - self._files.pop(key, 0)
+                self._files[key] = size
+                evicted = self._evict_disk()
+            self._unlink(evicted)
+
+    def _evict_disk(self) -> list:
+        """按字节上限淘汰磁盘层最久未使用的条目, 返回待删除的键, 需持有锁或在初始化时调用"""
+        evicted = []
+        while self.disk_used > self.disk_bytes and self._files:
+            key, size = self._files.popitem(last=False)
+            self.disk_used -= size
+            evicted.append(key)
+        return evicted
+
+    def _unlink(self, keys: list) -> None:
+        for key in keys:
+            try:
+                (self.disk_dir / f"{key}.json").unlink(missing_ok=True)
+            except OSError as e:
+                logging.error(f"删除定位缓存失败 {key}: {e}")
+
+    def _remember(self, key: str, boxs: dict[str, 'Box|None'], size: int) -> None:
+        """写入内存层并按字节上限淘汰最久未使用的条目"""
+        size += len(key)
+        with self._lock:
+            if key in self._entries:
+                self.bytes -= self._entries.pop(key)[1]
+            self._entries[key] = (boxs, size)
+            self.bytes += size
+            while self.bytes > self.max_bytes and self._entries:
+                self.bytes -= self._entries.popitem(last=False)[1][1]
+
+    def metrics(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.disk_hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self.bytes,
+                "max_bytes": self.max_bytes,
+                "disk_entries": len(self._files),
+                "disk_bytes": self.disk_used,
+                "max_disk_bytes": self.disk_bytes,
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": (self.hits + self.disk_hits) / lookups if lookups else 0.0,
+            }
+
+
+cache = LocateCache(CACHE_BYTES, CACHE_DIR, CACHE_DISK_BYTES)
+
+
+def get_instance() -> Cascade:
+    """获取当前worker共享的定位器实例, 首次调用时加载并预热模型"""
+    global instance, batcher, prechecker
+    if instance is None:
+        with _lock:
+            # 双重检查, 避免并发的首个请求重复加载权重
+            if instance is None:
+                locator = Cascade(tier_weights(), DEVICE)
+                locator.warmup()
+                if PRECHECK and PRECHECK_IMGSZ:
+                    prechecker = Locator(tier_weights()[0][0], DEVICE)
+                    prechecker.warmup(PRECHECK_IMGSZ)
+                batcher = MicroBatcher(locator.locate_batch, BATCH, MAX_WAIT, MAX_QUEUE)
+                instance = locator
+                ready.set()
+    return instance
+
+
+def get_batcher() -> MicroBatcher:
+    """获取当前worker共享的批处理器, 请求线程通过它提交图片"""
+    get_instance()
+    return batcher
+
+
+def init():
+    """在应用创建时加载并预热定位器"""
+    get_instance()
+
+
+def refine(img: np.ndarray, located: dict[str, 'Box|None']) -> dict[str, 'Box|None']:
+    """在原图上细化title/content框的边缘, 并记录各边的移动量"""
+    refined = {}
+    for k, box in located.items():
+        if box is None:
+            refined[k] = None
+            continue
+        (x1, y1, x2, y2), moves = refine_box(img, box.xyxy)
+        for edge, moved in moves.items():
+            refine_moves[edge].observe(moved)
+        refined[k] = replace(box, x1=x1, y1=y1, x2=x2, y2=y2)
+    # 细化可能使两个框重新重叠
+    if refined.get("title") and refined.get("content"):
+        refined["content"].adjust_based_on_title(refined["title"])
+    return refined
+
+
+def precheck(data: bytes):
+    """预检上传图片, 判断为空白页或非作文时抛出对应错误码的业务异常; 无法解码的图片交由后续流程处理"""
+    start = time.perf_counter()
+    code = None
+    try:
+        image = preview(data)
+        if image is None:
+            return
+        code = check(image)
+        if code is None and prechecker is not None:
+            with _precheck_lock:
+                located = prechecker.locate_batch([image], imgsz=PRECHECK_IMGSZ)[0]
+            if located["content"] is None:
+                code = ErrorCode.NOT_ESSAY
+    finally:
+        precheck_time.observe(time.perf_counter() - start)
+    if code is not None:
+        with _precheck_lock:
+            rejected[code.name] += 1
+        raise Be.error(code)
+
+
+def reduced_factor(data: bytes, imgsz: int = IMGSZ) -> int:
+    """只读取图片头获取尺寸, 选择解码后长边仍不小于推理尺寸的最大缩小倍数"""
+    try:
+        with Image.open(io.BytesIO(data)) as img:
+            long_side = max(img.size)
+    except Exception:
+        return 1
+    for factor in sorted(REDUCED_FLAGS, reverse=True):
+        if long_side // factor >= imgsz:
+            return factor
+    return 1
+
+
+def decode(data: bytes, factor: int = 1) -> 'np.ndarray | None':
+    """解码图片, factor > 1 时按倍数缩小解码(JPEG在DCT域完成, 不生成全尺寸图像)"""
+    return cv2.imdecode(np.frombuffer(data, np.uint8), REDUCED_FLAGS.get(factor, cv2.IMREAD_COLOR))
+
+
+# 对原图按定位结果进行切割, 返回base64和图片类型
+def crop(img: np.ndarray, boxs: dict[str, 'Box|None']):
     result = []
     # 切割图片
     for box in boxs.values():
@@ -130,31 +549,95 @@ def crop(imgs: List[np.ndarray], no, boxs: dict[str, 'Box|None']):
             img_base64 = base64.b64encode(buffer).decode('utf-8')
             result.append(
                 {"image": img_base64,
-                 "class": box.c})
+                 "class": box.c,
+                 "tier": box.tier})
     return result
 
 
 @bp.post("/locate")
 def locate():
-    global instance
+    """
+    定位并切割每张上传图片中的标题与正文, 切割结果带有所属图片的序号page
+    预检未通过的图片在结果中以{"page": 序号, "class": None, "code": 错误码, "msg": 错误信息}报告, 不影响其它图片;
+    所有图片都未通过预检时返回第一张图片的业务异常
+    """
     try:
-        if instance is None:
-            instance = Locator(MODEL, DEVICE)
-        ori_imgs = request.files.getlist("images")
-        # 将前端传入的图片转换成np_array
-        np_imgs: List[np.ndarray] = []
-        for img in ori_imgs:
-            # 使用内存文件流避免临时文件
-            img_stream = io.BytesIO(img.read())
-            img_stream.seek(0)  # 重置指针
-            np_img = cv2.imdecode(np.frombuffer(img_stream.getbuffer(), np.uint8), cv2.IMREAD_COLOR)
-            if np_img is not None:
-                np_imgs.append(np_img)
-            img_stream.close()  # 显式关闭
-        # 获取每一个图片的分割定位
-        boxs = []
-        for i in range(len(np_imgs)):
-            boxs.extend(crop(np_imgs, i, instance.locate(np_imgs[i])))
-        return rex.succeed(boxs)
+        batch_locator = get_batcher()
+        # 先查缓存, 命中的图片不再预检; 未命中的图片预检后以缩小解码的结果进行检测, 原始字节留待切割时再全尺寸解码
+        uploads = []  # [图片序号, 原始字节, 缓存键, 定位结果, 缩小图(命中缓存时为None)]
+        pending = []  # 未命中缓存且未能复用模板的(上传序号, 缩小图)
+        failures = []  # 预检未通过的(图片序号, 业务异常)
+        for page, img in enumerate(request.files.getlist("images")):
+            data = img.read()
+            key = cache.key(data)
+            located = cache.get(key)
+            small = None
+            if located is None:
+                if PRECHECK:
+                    try:
+                        precheck(data)
+                    except Be as e:
+                        failures.append((page, e))
+                        continue
+                small = decode(data, reduced_factor(data, max(imgsz for _, imgsz in TIERS)))
+                if small is None:
+                    continue
+                if TEMPLATE:
+                    start = time.perf_counter()
+                    located = templates.match(small)
+                    template_time.observe(time.perf_counter() - start)
+                if located is None:
+                    pending.append((len(uploads), small))
+            uploads.append([page, data, key, located, small])
+        if failures and not uploads:
+            raise failures[0][1]
+        # 批量获取未命中图片的分割定位
+        for (i, small), located in zip(pending, batch_locator.locate_batch([small for _, small in pending])):
+            uploads[i][3] = located
+            # 模型给出可信结果的图片作为新模板
+            if TEMPLATE and Cascade.confident(located):
+                templates.add(small, located)
+        # 逐张全尺寸解码并切割, 同一时刻只保留一张原图
+        boxs = [{"page": page, "class": None, "code": e.code, "msg": e.msg} for page, e in failures]
+        for page, data, key, located, small in uploads:
+            if all(box is None for box in located.values()):
+                if small is not None:
+                    cache.put(key, located)
+                continue
+            full = decode(data)
+            if small is not None:
+                # 本次推理的框映射回原图坐标后写入缓存
+                sx, sy = full.shape[1] / small.shape[1], full.shape[0] / small.shape[0]
+                located = {k: box.scale(sx, sy) if box else None for k, box in located.items()}
+                if REFINE:
+                    located = refine(full, located)
+                cache.put(key, located)
+            boxs.extend({**item, "page": page} for item in crop(full, located))
+        return rex.succeed(sorted(boxs, key=lambda item: item["page"]))
+    except Be as e:
+        return rex.fail(e)
     except Exception as e:
         abort(500, f"Error processing request: {str(e)}")
+
+
+@bp.get("/locate/ready")
+def locate_ready():
+    """就绪检查, 模型预热完成前返回503, 供负载均衡判断是否转发流量"""
+    if ready.is_set():
+        return rex.succeed({"ready": True})
+    return rex.fail({"ready": False}, msg="locator warming up"), 503
+
+
+@bp.get("/locate/metrics")
+def locate_metrics():
+    """批处理指标(批大小、排队等待时间、推理时间与队列深度)、缓存命中情况、级联各级作答数、框细化的边缘移动量、预检与模板复用情况"""
+    if not ready.is_set():
+        return rex.fail({"ready": False}, msg="locator warming up"), 503
+    return rex.succeed({
+        "batcher": batcher.metrics(),
+        "cache": cache.metrics(),
+        "cascade": instance.metrics(),
+        "refine": {edge: stats.to_dict() for edge, stats in refine_moves.items()},
+        "precheck": {"time": precheck_time.to_dict(), "rejected": dict(rejected)},
+        "template": {**templates.metrics(), "time": template_time.to_dict()},
+    })
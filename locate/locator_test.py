@@ -1,14 +1,11 @@
 import base64
-from io import BytesIO
 
 import cv2
 import numpy as np
 from flask import Blueprint, request
-from matplotlib import pyplot as plt
 
 from common import rex
-from common.consts import MODE
-from locate.locator import Locator, MODEL, DEVICE
+from locate.locator import get_batcher
 
 """
 locator_test.py 定位器的测试接口, 返回可视化的结果以检验效果
@@ -16,92 +13,96 @@ locator_test.py 定位器的测试接口, 返回可视化的结果以检验效
 
 bp = Blueprint('locate-test', __name__)
 
-
-def visualize_detection(image, boxes, titles):
-    """可视化检测结果"""
-    plt.figure(figsize=(12, 8))
-
-    # 绘制原图
-    plt.subplot(2, 2, 1)
-    plt.imshow(cv2.cvtColor(image, cv2.COLOR_BGR2RGB))
-    plt.title("Original Image")
-    plt.axis('off')
-
-    # 绘制带检测框的图像
+# 可视化结果的默认输出尺寸(宽, 高), 画面按2x2排列原图、检测框、标题区域与正文区域
+VIS_SIZE = (1200, 800)
+PANEL_TITLE_HEIGHT = 30  # 每个子图上方标题栏的高度
+MIN_SIZE = 200  # 允许的最小输出边长
+
+
+def fit_panel(image, width, height, title):
+    """将图片等比缩放后居中放入白底子图, 上方绘制标题"""
+    panel = np.full((height, width, 3), 255, np.uint8)
+    cv2.putText(panel, title, (10, PANEL_TITLE_HEIGHT - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 0, 0), 1,
+                cv2.LINE_AA)
+    if image is None or image.size == 0:
+        return panel
+    area_h = height - PANEL_TITLE_HEIGHT
+    scale = min(width / image.shape[1], area_h / image.shape[0])
+    w, h = max(1, int(image.shape[1] * scale)), max(1, int(image.shape[0] * scale))
+    resized = cv2.resize(image, (w, h), interpolation=cv2.INTER_AREA if scale < 1 else cv2.INTER_LINEAR)
+    x, y = (width - w) // 2, PANEL_TITLE_HEIGHT + (area_h - h) // 2
+    panel[y:y + h, x:x + w] = resized
+    return panel
+
+
+def visualize_detection(image, boxes, titles, size=VIS_SIZE):
+    """可视化检测结果, 直接用OpenCV拼接为一张图片并返回base64编码"""
+    width, height = size
+    panel_w, panel_h = width // 2, height // 2
+
+    # 绘制带检测框的图像, 线宽与字号随原图尺寸缩放, 保证缩小后仍清晰可见
     img_with_boxes = image.copy()
+    thickness = max(2, round(max(image.shape[:2]) / 400))
     for box, title in zip(boxes, titles):
         if box:
             x1, y1, x2, y2 = map(int, box.xyxy)
-            cv2.rectangle(img_with_boxes, (x1, y1), (x2, y2), (255, 0, 0), 8)
-            cv2.putText(img_with_boxes, f"{title} {box.conf:.2f}",
-                        (x1, y1 - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 0), 1)
-
-    plt.subplot(2, 2, 2)
-    plt.imshow(cv2.cvtColor(img_with_boxes, cv2.COLOR_BGR2RGB))
-    plt.title("Detection Results")
-    plt.axis('off')
-
-    # 绘制标题区域
-    if boxes[0]:
-        title_box = boxes[0]
-        x1, y1, x2, y2 = map(int, title_box.xyxy)
-        title_crop = image[y1:y2, x1:x2]
-        plt.subplot(2, 2, 3)
-        plt.imshow(cv2.cvtColor(title_crop, cv2.COLOR_BGR2RGB))
-        plt.title("Title Region")
-        plt.axis('off')
-
-    # 绘制内容区域
-    if boxes[1]:
-        content_box = boxes[1]
-        x1, y1, x2, y2 = map(int, content_box.xyxy)
-        content_crop = image[y1:y2, x1:x2]
-        plt.subplot(2, 2, 4)
-        plt.imshow(cv2.cvtColor(content_crop, cv2.COLOR_BGR2RGB))
-        plt.title("Content Region")
-        plt.axis('off')
-
-    plt.tight_layout()
-    if MODE == "test":
-        plt.show()
-    # 将图片保存到内存中的二进制流
-    buffer = BytesIO()
-    plt.savefig(buffer, format='jpg', dpi=100)
-    buffer.seek(0)  # 重置指针位置
-    plt.close()  # 关闭plt，释放内存
-
-    return base64.b64encode(buffer.getvalue()).decode('utf-8')  # 返回base64编码
-
-
-def test_locator(image):
-    # 初始化定位器
-    locator = Locator(weight=MODEL, device=DEVICE)
-    # 执行定位
-    result = locator.locate(image)
-
-    # 提取检测框
-    title_box = result["title"]
-    content_box = result["content"]
-
-    print("检测结果:")
-    print(f"- Title: {title_box.xyxy if title_box else '未检测到'}")
-    print(f"- Content: {content_box.xyxy if content_box else '未检测到'}")
-
-    # 可视化结果
-    return visualize_detection(image, [title_box, content_box], ["Title", "Content"])
+            cv2.rectangle(img_with_boxes, (x1, y1), (x2, y2), (255, 0, 0), thickness * 2)
+            cv2.putText(img_with_boxes, f"{title} {box.conf:.2f}", (x1, max(0, y1 - 10)),
+                        cv2.FONT_HERSHEY_SIMPLEX, thickness / 2, (0, 255, 0), thickness)
+
+    # 截取标题区域与内容区域
+    crops = []
+    for box in boxes:
+        if box:
+            x1, y1, x2, y2 = map(int, box.xyxy)
+            crops.append(image[y1:y2, x1:x2])
+        else:
+            crops.append(None)
+
+    panels = [
+        fit_panel(image, panel_w, panel_h, "Original Image"),
+        fit_panel(img_with_boxes, panel_w, panel_h, "Detection Results"),
+        fit_panel(crops[0], panel_w, panel_h, "Title Region"),
+        fit_panel(crops[1], panel_w, panel_h, "Content Region"),
+    ]
+    canvas = np.vstack([np.hstack(panels[:2]), np.hstack(panels[2:])])
+
+    _, buffer = cv2.imencode('.jpg', canvas)
+    return base64.b64encode(buffer).decode('utf-8')  # 返回base64编码
+
+
+def test_locator(images, size=VIS_SIZE):
+    # 使用与/locate相同的已预热模型, 经批处理器统一推理
+    results = get_batcher().locate_batch(images)
+
+    outputs = []
+    for image, result in zip(images, results):
+        # 提取检测框
+        title_box = result["title"]
+        content_box = result["content"]
+
+        print("检测结果:")
+        print(f"- Title: {title_box.xyxy if title_box else '未检测到'}")
+        print(f"- Content: {content_box.xyxy if content_box else '未检测到'}")
+
+        # 可视化结果
+        outputs.append(visualize_detection(image, [title_box, content_box], ["Title", "Content"], size))
+    return outputs
 
 
 @bp.post("/locate-test")
 def locate():
-    imgs = list(cv2.imdecode(np.frombuffer(file.read(), np.uint8), cv2.IMREAD_COLOR) for file in
-                request.files.getlist("images"))
-    boxs = []
-    for img in imgs:
-        boxs.append(test_locator(img))
-    return rex.succeed(boxs)
+    imgs = [img for img in (cv2.imdecode(np.frombuffer(file.read(), np.uint8), cv2.IMREAD_COLOR) for file in
+                            request.files.getlist("images")) if img is not None]
+    # 可通过表单参数width/height指定输出尺寸
+    size = (max(MIN_SIZE, request.form.get("width", VIS_SIZE[0], type=int)),
+            max(MIN_SIZE, request.form.get("height", VIS_SIZE[1], type=int)))
+    return rex.succeed(test_locator(imgs, size))
 
 
 if __name__ == "__main__":
     # 替换为您的测试图片路径
     test_image_path = r"asset/locator/val/predict/0377ac35a913fe307f9e9118398c587.jpg"
-    test_locator(test_image_path)
+    output = test_locator([cv2.imread(test_image_path)])[0]
+    with open("locate_test.jpg", "wb") as f:
+        f.write(base64.b64decode(output))
@@ -0,0 +1,107 @@
+import json
+from pathlib import Path
+
+from diff import AdvancedEvaluator, device_kind, use_split
+
+"""
+pareto.py 在当前机器上测试所有权重在候选输入尺寸下的耗时与精度, 计算耗时/召回率/IoU的帕累托前沿,
+并为当前设备类型(cpu/cuda)写入locator.py启动时读取的级联配置
+"""
+
+# 配置参数
+WEIGHTS_DIR = "./resource/weights/"
+IMAGE_SIZES = [480, 640, 800, 960, 1280, 1440]  # 候选输入尺寸
+TARGET_RECALL = 0.95  # 线上要求的最低召回率
+DEVICE = None  # 为空时有GPU则使用GPU, 否则使用CPU
+SPLIT = "val"  # 评估使用的数据集划分, 训练集上的召回率虚高, 据此选出的配置在线上达不到TARGET_RECALL
+CONFIG_FILE = "./resource/locator.json"
+DEFAULT_TIERS = [("200e4b1440sz-n", 640), ("200e4b1440sz-n", 1440)]  # 与locator.py中默认的TIERS一致
+
+
+def dominates(a, b):
+    """a不比b慢、召回率与IoU均不低于b, 且至少一项严格更优"""
+    no_worse = (a['inference_time'] <= b['inference_time'] and a['recall'] >= b['recall']
+                and a['avg_iou'] >= b['avg_iou'])
+    better = (a['inference_time'] < b['inference_time'] or a['recall'] > b['recall']
+              or a['avg_iou'] > b['avg_iou'])
+    return no_worse and better
+
+
+def pareto_frontier(points):
+    """返回不被其它配置支配的配置, 按耗时升序排列"""
+    frontier = [p for p in points if not any(dominates(q, p) for q in points if q is not p)]
+    return sorted(frontier, key=lambda p: p['inference_time'])
+
+
+def choose_tiers(frontier, target_recall=TARGET_RECALL):
+    """
+    选择级联配置: 第一级为满足目标召回率的最快配置, 第二级为召回率最高的配置
+    没有配置满足目标时只使用召回率最高的配置
+    """
+    best = max(frontier, key=lambda p: (p['recall'], p['avg_iou'], -p['inference_time']))
+    qualified = [p for p in frontier if p['recall'] >= target_recall]
+    fastest = min(qualified, key=lambda p: p['inference_time']) if qualified else best
+    return [fastest] if fastest is best else [fastest, best]
+
+
+def benchmark():
+    """顺序评估所有(权重, 尺寸)组合, 避免并行推理互相干扰耗时统计"""
+    use_split(SPLIT)
+    evaluator = AdvancedEvaluator()
+    points = []
+    for weight in sorted(Path(WEIGHTS_DIR).glob("*.pt")):
+        for imgsz in IMAGE_SIZES:
+            stats = evaluator.evaluate_model(str(weight), imgsz, device=DEVICE)
+            correct = stats['correct_detections']
+            points.append({
+                'weight': weight.stem,
+                'imgsz': imgsz,
+                'recall': correct / (correct + stats['false_negatives'] + 1e-6),
+                'precision': correct / (correct + stats['false_positives'] + 1e-6),
+                'avg_iou': stats['avg_iou'],
+                'inference_time': stats['inference_time'],
+            })
+    return points
+
+
+def write_config(kind, tiers, frontier):
+    """只更新当前设备类型的配置, 保留其它设备类型已写入的配置"""
+    path = Path(CONFIG_FILE)
+    config = json.loads(path.read_text()) if path.exists() else {}
+    config[kind] = {
+        'tiers': [[p['weight'], p['imgsz']] for p in tiers],
+        'target_recall': TARGET_RECALL,
+        'frontier': frontier,
+    }
+    path.write_text(json.dumps(config, indent=2, ensure_ascii=False))
+
+
+def read_tiers(kind):
+    """读取设备类型kind的级联配置[(权重名, 输入尺寸)], 与locator.py启动时一致, 配置不存在时使用DEFAULT_TIERS"""
+    path = Path(CONFIG_FILE)
+    config = json.loads(path.read_text()) if path.exists() else {}
+    tiers = config.get(kind, {}).get('tiers')
+    return [(str(name), int(imgsz)) for name, imgsz in tiers] if tiers else DEFAULT_TIERS
+
+
+def serving_sizes(kind, weight=None):
+    """线上在设备类型kind上使用的输入尺寸(升序), weight不为空时只取该权重所在的级, 该权重不在级联配置中时取所有级"""
+    tiers = read_tiers(kind)
+    sizes = {imgsz for name, imgsz in tiers if weight is None or name == Path(weight).stem}
+    return sorted(sizes or {imgsz for _, imgsz in tiers})
+
+
+if __name__ == "__main__":
+    kind = device_kind(DEVICE)
+    results = benchmark()
+    pareto = pareto_frontier(results)
+    chosen = choose_tiers(pareto)
+    write_config(kind, chosen, pareto)
+
+    print(f"\n=== 帕累托前沿 ({kind}) ===")
+    for p in pareto:
+        mark = "✅" if p in chosen else "  "
+        print(f"{mark} {p['weight']}@{p['imgsz']}: 召回率 {p['recall']:.2%}, 平均IoU {p['avg_iou']:.3f}, "
+              f"耗时 {p['inference_time'] * 1000:.1f}ms/张")
+    print(f"\n🏆 级联配置: {' -> '.join(p['weight'] + '@' + str(p['imgsz']) for p in chosen)}")
+    print(f"📁 配置已写入: {Path(CONFIG_FILE).absolute()}")
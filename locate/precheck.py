@@ -0,0 +1,82 @@
+import io
+
+import cv2
+import numpy as np
+from PIL import Image, ExifTags
+
+from common.error_code import ErrorCode
+
+"""
+precheck.py 上传图片的快速预检
+优先使用JPEG内嵌的EXIF缩略图, 没有缩略图时按倍数缩小解码, 在几百像素的预览图上统计墨迹与文字状连通域,
+空白页、自拍、风景照等明显不是作文的图片在解码原图与模型推理之前即被拒绝
+"""
+
+PREVIEW_SIZE = 256  # 预览图的长边(像素)
+REDUCED_FLAGS = {2: cv2.IMREAD_REDUCED_COLOR_2, 4: cv2.IMREAD_REDUCED_COLOR_4, 8: cv2.IMREAD_REDUCED_COLOR_8}
+MIN_THUMBNAIL = 96  # EXIF缩略图长边小于该值时改为缩小解码
+BLANK_INK = 0.004  # 墨迹像素占比低于该值视为空白页
+MAX_INK = 0.45  # 墨迹像素占比高于该值视为照片等大面积纹理
+MAX_CHAR_AREA = 0.002  # 单个文字状连通域面积占预览图的最大比例
+MIN_CHARS = 40  # 文字状连通域少于该数量视为不是作文
+# EXIF方向为3/6/8时对应的旋转, 与cv2.imdecode对原图的处理保持一致
+ORIENTATION_ROTATE = {3: cv2.ROTATE_180, 6: cv2.ROTATE_90_CLOCKWISE, 8: cv2.ROTATE_90_COUNTERCLOCKWISE}
+
+
+def exif_thumbnail(img: Image.Image) -> 'np.ndarray | None':
+    """读取JPEG内嵌的EXIF缩略图(IFD1), 只解析文件头, 不解码原图"""
+    raw = img.info.get("exif")
+    if not raw:
+        return None
+    exif = img.getexif()
+    ifd1 = exif.get_ifd(ExifTags.IFD.IFD1)
+    offset, length = ifd1.get(0x0201), ifd1.get(0x0202)  # JPEGInterchangeFormat(Length)
+    if not offset or not length:
+        return None
+    # 偏移量相对TIFF头, info["exif"]以6字节的"Exif\0\0"开头
+    start = 6 if raw[:6] == b"Exif\x00\x00" else 0
+    thumb = cv2.imdecode(np.frombuffer(raw[start + offset:start + offset + length], np.uint8), cv2.IMREAD_COLOR)
+    if thumb is None or max(thumb.shape[:2]) < MIN_THUMBNAIL:
+        return None
+    rotate = ORIENTATION_ROTATE.get(exif.get(ExifTags.Base.Orientation))
+    return cv2.rotate(thumb, rotate) if rotate is not None else thumb
+
+
+def preview(data: bytes, size: int = PREVIEW_SIZE) -> 'np.ndarray | None':
+    """生成长边约为size的BGR预览图, 无法解码时返回None"""
+    try:
+        with Image.open(io.BytesIO(data)) as img:
+            thumb = exif_thumbnail(img)
+            long_side = max(img.size)
+    except Exception:
+        return None
+    if thumb is None:
+        factor = max([f for f in REDUCED_FLAGS if long_side // f >= size], default=1)
+        thumb = cv2.imdecode(np.frombuffer(data, np.uint8), REDUCED_FLAGS.get(factor, cv2.IMREAD_COLOR))
+        if thumb is None:
+            return None
+    scale = size / max(thumb.shape[:2])
+    if scale < 1:
+        thumb = cv2.resize(thumb, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    return thumb
+
+
+def text_stats(image: np.ndarray):
+    """统计预览图的墨迹占比与文字状(面积较小)连通域的数量"""
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image
+    binary = cv2.adaptiveThreshold(gray, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY_INV, 15, 10)
+    ink = np.count_nonzero(binary) / binary.size
+    _, _, stats, _ = cv2.connectedComponentsWithStats(binary, connectivity=8)
+    areas = stats[1:, cv2.CC_STAT_AREA]
+    chars = int(np.count_nonzero((areas >= 2) & (areas <= MAX_CHAR_AREA * binary.size)))
+    return ink, chars
+
+
+def check(image: np.ndarray) -> 'ErrorCode | None':
+    """根据墨迹占比与文字状连通域数量判断预览图是否可能是作文, 可能是作文时返回None"""
+    ink, chars = text_stats(image)
+    if ink < BLANK_INK:
+        return ErrorCode.BLANK_IMAGE
+    if ink > MAX_INK or chars < MIN_CHARS:
+        return ErrorCode.NOT_ESSAY
+    return None
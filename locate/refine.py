@@ -0,0 +1,88 @@
+from typing import Tuple
+
+import cv2
+import numpy as np
+
+"""
+refine.py 检测框边缘细化
+在预测边缘两侧截取窄条, 二值化后用行/列投影找到墨迹边界, 把低分辨率检测得到的粗糙边缘贴合到文字
+"""
+
+MARGIN_RATIO = 0.05  # 窄条向框外延伸的宽度占框边长的比例, 向框内延伸该宽度的INNER_SCALE倍
+MIN_MARGIN = 8  # 窄条向框外延伸的最小宽度(像素)
+INNER_SCALE = 3  # 粗框多为偏大, 向内搜索的范围大于向外
+INK_RATIO = 0.02  # 投影中墨迹像素占比超过该值的行/列视为有墨迹
+PAD = 2  # 细化后在墨迹边界外保留的像素
+
+
+def ink_profile(strip: np.ndarray, axis: int) -> np.ndarray:
+    """二值化窄条并沿axis投影, 返回每行/列是否有墨迹"""
+    gray = cv2.cvtColor(strip, cv2.COLOR_BGR2GRAY) if strip.ndim == 3 else strip
+    binary = cv2.adaptiveThreshold(gray, 1, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY_INV, 15, 10)
+    return binary.mean(axis=axis) > INK_RATIO
+
+
+def snap(ink: np.ndarray, edge: int, gap: int) -> int:
+    """
+    在由外向内排列的墨迹序列中移动边缘
+    边缘外gap范围内有墨迹(框切到了文字)时向外扩展到墨迹尽头, 期间最多跨过gap个空白行/列;
+    否则向内收紧到第一处墨迹, 窄条内没有墨迹时保持不变
+    """
+    if ink[max(0, edge - gap):edge + 1].any():
+        last = edge
+        for k in range(edge, -1, -1):
+            if ink[k]:
+                last = k
+            elif last - k > gap:
+                break
+        return max(0, last - PAD)
+    inner = np.flatnonzero(ink[edge:])
+    if inner.size == 0:
+        return edge
+    return edge + max(0, int(inner[0]) - PAD)
+
+
+def refine_edge(img: np.ndarray, edge: int, lo: int, hi: int, vertical: bool, outward_low: bool) -> int:
+    """
+    细化一条边
+    :param edge: 边所在的坐标
+    :param lo, hi: 边沿方向上的范围(如左边为y1, y2)
+    :param vertical: 竖直边(左右)为True, 水平边(上下)为False
+    :param outward_low: 框外侧在坐标较小一侧(左边、上边)为True
+    """
+    size = img.shape[1] if vertical else img.shape[0]
+    margin = max(MIN_MARGIN, int((hi - lo) * MARGIN_RATIO))
+    outer, inner = margin, margin * INNER_SCALE
+    if outward_low:
+        start, end = max(0, edge - outer), min(size, edge + inner + 1)
+    else:
+        start, end = max(0, edge - inner), min(size, edge + outer + 1)
+    if end - start < 2 or hi - lo < 2:
+        return edge
+    strip = img[lo:hi, start:end] if vertical else img[start:end, lo:hi]
+    ink = ink_profile(strip, axis=0 if vertical else 1)
+    # 文字内部笔画间的空白随尺寸增大, 允许跨过的空白取外延宽度的三分之一
+    gap = max(PAD, margin // 3)
+    if outward_low:
+        return start + snap(ink, edge - start, gap)
+    return end - 1 - snap(ink[::-1], end - 1 - edge, gap)
+
+
+def refine_box(img: np.ndarray, xyxy: Tuple[float, float, float, float]):
+    """
+    将框的四条边贴合到墨迹边界
+    :return: (细化后的(x1, y1, x2, y2), 各边坐标的变化量(像素))
+    """
+    h, w = img.shape[:2]
+    x1, y1, x2, y2 = (int(round(v)) for v in xyxy)
+    x1, x2 = min(max(0, x1), w - 1), min(max(0, x2), w - 1)
+    y1, y2 = min(max(0, y1), h - 1), min(max(0, y2), h - 1)
+    nx1 = refine_edge(img, x1, y1, y2, vertical=True, outward_low=True)
+    nx2 = refine_edge(img, x2, y1, y2, vertical=True, outward_low=False)
+    ny1 = refine_edge(img, y1, x1, x2, vertical=False, outward_low=True)
+    ny2 = refine_edge(img, y2, x1, x2, vertical=False, outward_low=False)
+    # 细化结果异常(边缘交错)时保持原框
+    if nx2 - nx1 < 2 or ny2 - ny1 < 2:
+        nx1, ny1, nx2, ny2 = x1, y1, x2, y2
+    moves = {"x1": nx1 - x1, "y1": ny1 - y1, "x2": nx2 - x2, "y2": ny2 - y2}
+    return (float(nx1), float(ny1), float(nx2), float(ny2)), moves
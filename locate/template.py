@@ -0,0 +1,125 @@
+import threading
+from collections import deque
+from dataclasses import replace
+
+import cv2
+import numpy as np
+
+"""
+template.py 同一答题纸模板的版面复用
+同一班级提交的同款答题纸上title/content的位置几乎相同, 首张图片检测后保存为模板,
+后续图片在低分辨率下用ORB特征点与模板对齐, 对齐成功时将模板框按估计的相似变换映射到新图片上, 只有对齐失败时才运行模型
+"""
+
+SIZE = 512  # 对齐时图片的长边(像素)
+MAX_TEMPLATES = 4  # 最多保存的模板数, 超出时淘汰最久未命中的模板
+FEATURES = 1500  # 每张图片提取的ORB特征点数
+RATIO = 0.75  # 最近邻匹配的比率检验阈值
+MIN_INLIERS = 15  # RANSAC内点少于该数量视为对齐失败
+MIN_INLIER_RATIO = 0.25  # 内点占匹配点的比例低于该值视为对齐失败
+MAX_SCALE_CHANGE = 0.2  # 允许的缩放变化
+MAX_ROTATION = 10  # 允许的旋转角度(度)
+TEMPLATE_TIER = -1  # 复用模板得到的框的tier
+
+
+def features(image: np.ndarray):
+    """将图片缩放到长边为SIZE并提取ORB特征, 返回(缩放比例, 特征点坐标, 描述子)"""
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image
+    scale = min(1.0, SIZE / max(gray.shape[:2]))
+    if scale < 1:
+        gray = cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    keypoints, descriptors = cv2.ORB_create(FEATURES).detectAndCompute(gray, None)
+    points = np.float32([kp.pt for kp in keypoints]).reshape(-1, 2)
+    return scale, points, descriptors
+
+
+def estimate(template, target):
+    """
+    估计模板到目标图片(均为缩放后坐标)的相似变换, 检验不通过时返回None
+    :param template, target: features()的返回值
+    """
+    _, t_points, t_desc = template
+    _, points, desc = target
+    if t_desc is None or desc is None or len(t_desc) < 2 or len(desc) < 2:
+        return None
+    pairs = cv2.BFMatcher(cv2.NORM_HAMMING).knnMatch(t_desc, desc, k=2)
+    good = [p[0] for p in pairs if len(p) == 2 and p[0].distance < RATIO * p[1].distance]
+    if len(good) < MIN_INLIERS:
+        return None
+    src = t_points[[m.queryIdx for m in good]]
+    dst = points[[m.trainIdx for m in good]]
+    matrix, inliers = cv2.estimateAffinePartial2D(src, dst, method=cv2.RANSAC, ransacReprojThreshold=3.0)
+    if matrix is None:
+        return None
+    count = int(inliers.sum())
+    if count < MIN_INLIERS or count / len(good) < MIN_INLIER_RATIO:
+        return None
+    scale = float(np.hypot(matrix[0, 0], matrix[1, 0]))
+    angle = float(np.degrees(np.arctan2(matrix[1, 0], matrix[0, 0])))
+    if abs(scale - 1) > MAX_SCALE_CHANGE or abs(angle) > MAX_ROTATION:
+        return None
+    return matrix
+
+
+def transform_box(box, matrix, src_scale, dst_scale, shape):
+    """将模板图片上的框经变换映射到目标图片上, 取四角的外接矩形并裁剪到图片范围内"""
+    corners = np.float32([[box.x1, box.y1], [box.x2, box.y1], [box.x1, box.y2], [box.x2, box.y2]]) * src_scale
+    mapped = cv2.transform(corners[None], matrix)[0] / dst_scale
+    h, w = shape[:2]
+    x1, y1 = np.clip(mapped.min(axis=0), 0, [w, h])
+    x2, y2 = np.clip(mapped.max(axis=0), 0, [w, h])
+    return replace(box, x1=float(x1), y1=float(y1), x2=float(x2), y2=float(y2), tier=TEMPLATE_TIER)
+
+
+class Template:
+    """模板图片的特征与定位结果, 定位结果的坐标与保存模板时的图片一致"""
+
+    def __init__(self, image: np.ndarray, located: dict):
+        self.features = features(image)
+        self.located = located
+
+
+class TemplateMatcher:
+    """
+    TemplateMatcher 版面模板库
+    按最近命中排列, 新图片依次与各模板对齐
+    """
+
+    def __init__(self, max_templates: int = MAX_TEMPLATES):
+        self.templates = deque(maxlen=max_templates)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def add(self, image: np.ndarray, located: dict):
+        """以图片与其可信的定位结果新增模板"""
+        template = Template(image, located)
+        with self._lock:
+            self.templates.appendleft(template)
+
+    def match(self, image: np.ndarray):
+        """与各模板对齐, 成功时返回映射到image坐标的定位结果, 否则返回None"""
+        with self._lock:
+            templates = list(self.templates)
+        if not templates:
+            return None
+        target = features(image)
+        for template in templates:
+            matrix = estimate(template.features, target)
+            if matrix is None:
+                continue
+            with self._lock:
+                # 命中的模板移到最前, 优先与下一张图片对齐
+                if template in self.templates:
+                    self.templates.remove(template)
+                    self.templates.appendleft(template)
+                self.hits += 1
+            return {k: transform_box(box, matrix, template.features[0], target[0], image.shape) if box else None
+                    for k, box in template.located.items()}
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def metrics(self) -> dict:
+        with self._lock:
+            return {"templates": len(self.templates), "hits": self.hits, "misses": self.misses}
@@ -0,0 +1,41 @@
+import torch
+from ultralytics import YOLO
+from ultralytics.cfg import get_cfg
+
+from train import forward_layers, frozen_outputs, head_step
+
+"""
+test_train.py 检测头微调的单步测试
+不依赖数据集与权重文件: 由模型配置构建网络, 以随机图片生成缓存特征后训练一步,
+ultralytics升级或回退导致损失函数等接口变化时在这里失败
+"""
+
+
+def test_head_step():
+    torch.manual_seed(0)
+    net = YOLO("yolo11n.yaml").model
+    start = len(net.model) - 1
+    net.float().cpu()
+    for p in net.parameters():
+        p.requires_grad = False
+    net.eval()
+
+    keep = frozen_outputs(net, start)
+    images = torch.rand(2, 3, 64, 64)
+    y = {}
+    with torch.inference_mode():
+        forward_layers(net.model[:start], images, y, set(keep) | set(net.save))
+    labels = (torch.zeros(1, 1), torch.tensor([[0.5, 0.5, 0.4, 0.3]]))
+    samples = [([y[j][b].half() for j in keep], *labels) for b in range(images.shape[0])]
+
+    head = net.model[start:]
+    params = list(head.parameters())
+    for p in params:
+        p.requires_grad = True
+    head.train()
+    net.args = get_cfg()
+    before = [p.detach().clone() for p in params]
+    items = head_step(net, head, start, samples, keep, [0, 1], torch.optim.AdamW(params, lr=1e-3))
+
+    assert items.shape == (3,) and torch.isfinite(items).all()
+    assert any(not torch.equal(a, p) for a, p in zip(before, params))
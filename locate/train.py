@@ -1,17 +1,100 @@
+import json
 import os
+import time
 from pathlib import Path
 
+import cv2
+import numpy as np
 import torch
+from torch.utils.data import DataLoader
 from ultralytics import YOLO
+from ultralytics.cfg import get_cfg
+from ultralytics.data import YOLODataset, build_yolo_dataset
+from ultralytics.data.utils import check_det_dataset
+from ultralytics.models.yolo.detect import DetectionTrainer
+from ultralytics.utils import colorstr
+
+try:
+    from ultralytics.utils.torch_utils import unwrap_model
+except ImportError:  # requirements.txt固定的8.3.x中名为de_parallel
+    from ultralytics.utils.torch_utils import de_parallel as unwrap_model
+
+from dataset_cache import DatasetCache
 
 """
 train.py 定位器的训练过程
+已运行dataset_cache.py且缓存包含训练尺寸时, 训练与验证直接读取预解码的图片, 不再逐轮解码JPEG
+MODE为head时在CPU上微调: 冻结骨干网络与颈部, 一次性缓存检测头的输入特征, 之后每轮只训练检测头
 """
 
 os.environ['KMP_DUPLICATE_LIB_OK'] = 'True'
 
 MODEL = './resource/weights/yolo11n.pt'
 DATA = './resource/dataset/data.yaml'
+IMGSZ = 1440
+# full: GPU全量训练; head: CPU上冻结骨干网络只训练检测头, 用于在新的答题纸模板上快速微调
+MODE = 'full' if torch.cuda.is_available() else 'head'
+HEAD_MODEL = './resource/weights/200e4b1440sz-n.pt'  # 在已训练的定位器上微调
+HEAD_IMGSZ = 640  # 降低输入尺寸, 缩短特征缓存与训练时间并减少缓存占用的内存
+HEAD_EPOCHS = 30
+HEAD_BATCH = 16
+HEAD_LR = 1e-3
+HEAD_OUTPUT = './runs/head/'
+
+
+class CachedYOLODataset(YOLODataset):
+    """
+    从预解码缓存读取图片的YOLODataset
+    缓存中的图片已按imgsz等比缩放, 标注为归一化坐标, 无需换算
+    """
+
+    def __init__(self, *args, dataset_cache: DatasetCache, **kwargs):
+        self.dataset_cache = dataset_cache
+        super().__init__(*args, **kwargs)
+
+    def load_image(self, i, rect_mode=True, *args, **kwargs):
+        stem = Path(self.im_files[i]).stem
+        # 数据增强会原地修改图片, 从只读内存映射拷贝一份
+        im = np.ascontiguousarray(self.dataset_cache.image(stem, self.imgsz))
+        if not rect_mode:
+            im = cv2.resize(im, (self.imgsz, self.imgsz), interpolation=cv2.INTER_LINEAR)
+        if self.augment:
+            # 维护马赛克增强所需的最近加载图片列表, 与BaseDataset.load_image一致
+            self.buffer.append(i)
+            if 1 < len(self.buffer) >= self.max_buffer_length:
+                self.buffer.pop(0)
+        return im, self.dataset_cache.shape(stem), im.shape[:2]
+
+
+class CachedDetectionTrainer(DetectionTrainer):
+    """数据集划分的全部图片都在缓存中时使用CachedYOLODataset, 否则回退为默认数据集"""
+
+    def build_dataset(self, img_path, mode="train", batch=None):
+        split = Path(img_path).parent.name
+        cache = DatasetCache.open(split)
+        files = [p for p in Path(img_path).iterdir() if p.suffix.lower() in ('.jpg', '.jpeg', '.png')]
+        if cache is None or not all(cache.has(p.stem, self.args.imgsz, p) for p in files):
+            print(f"⚠️ {split}: 预解码缓存缺失或已过期, 读取原图")
+            return super().build_dataset(img_path, mode, batch)
+        gs = max(int(unwrap_model(self.model).stride.max()), 32)
+        return CachedYOLODataset(
+            img_path=img_path,
+            imgsz=self.args.imgsz,
+            batch_size=batch,
+            augment=mode == "train",
+            hyp=self.args,
+            rect=self.args.rect or mode == "val",
+            cache=None,
+            single_cls=self.args.single_cls or False,
+            stride=gs,
+            pad=0.0 if mode == "train" else 0.5,
+            prefix=colorstr(f"{mode}: "),
+            task=self.args.task,
+            classes=self.args.classes,
+            data=self.data,
+            fraction=self.args.fraction if mode == "train" else 1.0,
+            dataset_cache=cache,
+        )
 
 
 def validate_dataset(data_yaml):
@@ -31,17 +114,165 @@ def validate_dataset(data_yaml):
         print(f"✅ {split}: Found {len(txt_files)} labels")
 
 
-if __name__ == "__main__":
+def frozen_outputs(net, start):
+    """冻结部分(第0..start-1层)中被可训练部分引用的层序号, 即需要缓存的特征"""
+    needed = {start - 1}
+    for m in net.model[start:]:
+        for j in ([m.f] if isinstance(m.f, int) else m.f):
+            if j != -1 and j < start:
+                needed.add(j)
+    return sorted(needed)
+
+
+def forward_layers(layers, x, y, keep=None):
+    """
+    按DetectionModel的方式依次执行layers
+    :param x: 第一层的输入(上一层的输出)
+    :param y: 层序号 -> 输出, 供引用非相邻层的模块读取, 执行过程中按keep保存新的输出(keep为None时全部保存)
+    """
+    for m in layers:
+        if m.f != -1:
+            x = y[m.f] if isinstance(m.f, int) else [x if j == -1 else y[j] for j in m.f]
+        x = m(x)
+        if keep is None or m.i in keep:
+            y[m.i] = x
+    return x
+
+
+def cache_features(net, start, img_path, data, cfg):
+    """
+    不做数据增强, 逐批计算冻结部分的输出并以float16保存在内存中
+    :return: [(各缓存层的特征, 类别(M, 1), 归一化xywh(M, 4)), ...]
+    """
+    keep = frozen_outputs(net, start)
+    dataset = build_yolo_dataset(cfg, img_path, HEAD_BATCH, data, mode="val", rect=False,
+                                 stride=max(int(net.stride.max()), 32))
+    loader = DataLoader(dataset, batch_size=HEAD_BATCH, shuffle=False, num_workers=min(8, os.cpu_count() or 1),
+                        collate_fn=dataset.collate_fn)
+    samples = []
+    with torch.inference_mode():
+        for batch in loader:
+            y = {}
+            # 冻结部分内部引用的层(net.save)同样需要保留输出
+            forward_layers(net.model[:start], batch["img"].float() / 255, y, set(keep) | set(net.save))
+            for b in range(batch["img"].shape[0]):
+                mask = batch["batch_idx"] == b
+                samples.append(([y[j][b].half() for j in keep], batch["cls"][mask], batch["bboxes"][mask]))
+    return keep, samples
+
+
+def head_batch(samples, keep, indices):
+    """将缓存的样本拼成一批检测头的输入与ultralytics损失函数所需的标注"""
+    y = {j: torch.stack([samples[i][0][k] for i in indices]).float() for k, j in enumerate(keep)}
+    batch = {
+        "cls": torch.cat([samples[i][1] for i in indices]),
+        "bboxes": torch.cat([samples[i][2] for i in indices]),
+        "batch_idx": torch.cat([torch.full((len(samples[i][1]),), b, dtype=torch.float32)
+                                for b, i in enumerate(indices)]),
+    }
+    return y, batch
+
+
+def loss_items(items):
+    """ultralytics 8.4的损失函数以字典返回各项损失, 8.3.x返回张量, 统一为(box, cls, dfl)张量"""
+    return torch.stack(list(items.values())) if isinstance(items, dict) else items
+
+
+def head_step(net, head, start, samples, keep, indices, optimizer):
+    """用indices对应的缓存样本训练检测头一步, 返回该批的(box, cls, dfl)损失"""
+    y, batch = head_batch(samples, keep, indices)
+    loss, items = net.loss(batch, forward_layers(head, y[start - 1], y))
+    optimizer.zero_grad()
+    loss.sum().backward()
+    optimizer.step()
+    return loss_items(items).detach()
+
+
+def box_metrics(weight, imgsz):
+    """在验证集上评估权重, 返回精确率、召回率与mAP"""
+    box = YOLO(weight).val(data=DATA, imgsz=imgsz, batch=HEAD_BATCH, device='cpu', plots=False, verbose=False).box
+    return {'precision': float(box.mp), 'recall': float(box.mr), 'map50': float(box.map50), 'map50-95': float(box.map)}
+
+
+def train_head():
+    """冻结检测头之前的全部层, 缓存检测头的输入特征后只训练检测头, 并报告耗时与微调前后的指标"""
+    total_start = time.time()
+    torch.manual_seed(0)
+    model = YOLO(HEAD_MODEL)
+    net = model.model
+    start = len(net.model) - 1  # 检测头(Detect)为最后一层
+    data = check_det_dataset(DATA)
+    cfg = get_cfg(overrides={'imgsz': HEAD_IMGSZ, 'batch': HEAD_BATCH, 'data': DATA})
+
+    net.float().cpu()
+    for p in net.parameters():
+        p.requires_grad = False
+    net.eval()
+    cache_start = time.time()
+    keep, samples = cache_features(net, start, data['train'], data, cfg)
+    cache_time = time.time() - cache_start
+    print(f"✅ 已缓存 {len(samples)} 张图片的检测头输入特征, 耗时 {cache_time:.1f}s")
+
+    head = net.model[start:]
+    params = list(head.parameters())
+    for p in params:
+        p.requires_grad = True
+    head.train()
+    train_args, net.args = net.args, cfg  # 损失函数从model.args读取box/cls/dfl增益
+    optimizer = torch.optim.AdamW(params, lr=HEAD_LR, weight_decay=5e-4)
+    train_start = time.time()
+    for epoch in range(HEAD_EPOCHS):
+        order = torch.randperm(len(samples)).tolist()
+        losses = []
+        for i in range(0, len(order), HEAD_BATCH):
+            losses.append(head_step(net, head, start, samples, keep, order[i:i + HEAD_BATCH], optimizer))
+        mean = torch.stack(losses).mean(0).tolist()
+        print(f"[{epoch + 1}/{HEAD_EPOCHS}] box {mean[0]:.4f} cls {mean[1]:.4f} dfl {mean[2]:.4f}")
+    train_time = time.time() - train_start
+
+    net.args = train_args
+    del net.criterion
+    output = Path(HEAD_OUTPUT)
+    output.mkdir(parents=True, exist_ok=True)
+    weight = output / f"{Path(HEAD_MODEL).stem}-head{HEAD_IMGSZ}.pt"
+    head.eval()
+    model.save(weight)
+
+    summary = {
+        'base': HEAD_MODEL,
+        'weight': str(weight),
+        'imgsz': HEAD_IMGSZ,
+        'epochs': HEAD_EPOCHS,
+        'images': len(samples),
+        'cache_time': cache_time,
+        'train_time': train_time,
+        'metrics_before': box_metrics(HEAD_MODEL, HEAD_IMGSZ),
+        'metrics_after': box_metrics(str(weight), HEAD_IMGSZ),
+        'wall_time': time.time() - total_start,
+    }
+    (output / 'summary.json').write_text(json.dumps(summary, indent=2, ensure_ascii=False))
+    print("\n=== 检测头微调完成 ===")
+    print(f"⏱️ 特征缓存 {cache_time:.1f}s, 训练 {train_time:.1f}s, 总耗时 {summary['wall_time']:.1f}s")
+    for name in ('metrics_before', 'metrics_after'):
+        m = summary[name]
+        print(f"📊 {'微调前' if name == 'metrics_before' else '微调后'}: P {m['precision']:.3f} R {m['recall']:.3f} "
+              f"mAP50 {m['map50']:.3f} mAP50-95 {m['map50-95']:.3f}")
+    print(f"📁 权重与汇总已保存至: {output.absolute()}")
+
+
+def train_full():
+    """GPU全量训练, 并报告耗时与最终指标"""
     print(torch.cuda.is_available())
     print(torch.version.cuda)
     print(torch.cuda.get_device_name(0))
-    validate_dataset('resource/dataset/data.yaml')
     model = YOLO(MODEL)
+    start = time.time()
     result = model.train(
+        trainer=CachedDetectionTrainer,
         data=DATA,
         epochs=200,
         batch=8,
-        imgsz=1440,
+        imgsz=IMGSZ,
         name='essay_test',
         mosaic=0.5,  # 马赛克增强概率
         mixup=0.1,  # 图像混合增强
@@ -49,3 +280,14 @@ if __name__ == "__main__":
         augment=False,  # 关闭自动增强
         dropout=0.2,  # 添加dropout防止过拟合
     )
+    print(f"⏱️ 训练总耗时 {time.time() - start:.1f}s")
+    if result is not None:
+        print(f"📊 {result.results_dict}")
+
+
+if __name__ == "__main__":
+    validate_dataset('resource/dataset/data.yaml')
+    if MODE == 'head':
+        train_head()
+    else:
+        train_full()
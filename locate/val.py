@@ -1,8 +1,16 @@
+import json
+import queue
+import threading
 import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
+import cv2
 from ultralytics import YOLO
 
+from dataset_cache import DatasetCache
+
 """
 val.py 批量识别图片, 以人为观察效果
 200e4b1440sz-s.pt - 大部分title的置信度均低于0.4
@@ -17,6 +25,14 @@ WEIGHT = './resource/weights/200e4b1440sz-n.pt'  # 模型路径
 INPUT_FOLDER = './resource/dataset/train/images/'  # 输入文件夹路径
 OUTPUT_FOLDER = '../asset/locate/val/'  # 输出文件夹路径
 DEVICE = "cpu"
+# 流式模式: 读取线程池预先解码图片, 批量推理, 结果逐行写入jsonl, 标注图片由后台线程写入或不保存
+STREAM = True
+STREAM_BATCH = 8  # 单次推理的图片数
+READERS = 4  # 解码图片的线程数
+SAVE_IMAGES = False  # 是否保存标注后的图片
+RESULTS_FILE = OUTPUT_FOLDER + 'results.jsonl'
+STREAM_IMGSZ = 640  # 流式模式的输入尺寸, 已运行dataset_cache.py时直接读取该尺寸的预解码图片
+SPLIT = "train"  # INPUT_FOLDER对应的数据集划分
 
 
 def validate_model(weight_path):
@@ -45,20 +61,25 @@ def process_single_image(model, image_path, output_dir):
     )
 
     # 返回检测结果信息
-    detection_info = []
-    for result in results:
-        boxes_info = []
-        for box in result.boxes:
-            boxes_info.append({
-                'class': model.names[int(box.cls)],
-                'confidence': round(box.conf.item(), 2),
-                'coordinates': [round(x, 2) for x in box.xyxy.tolist()[0]]
-            })
-        detection_info.append({
-            'image_name': Path(image_path).name,
-            'detections': boxes_info
+    return [detection_info(model, image_path, result) for result in results]
+
+
+def detection_info(model, image_path, result, to_original=None):
+    """整理单张图片的检测结果, to_original用于将预解码图片上的坐标映射回原图"""
+    boxes_info = []
+    for box in result.boxes:
+        xyxy = box.xyxy.tolist()[0]
+        if to_original is not None:
+            xyxy = to_original(xyxy)[0].tolist()
+        boxes_info.append({
+            'class': model.names[int(box.cls)],
+            'confidence': round(box.conf.item(), 2),
+            'coordinates': [round(x, 2) for x in xyxy]
         })
-    return detection_info
+    return {
+        'image_name': Path(image_path).name,
+        'detections': boxes_info
+    }
 
 
 def run_batch_detection():
@@ -119,8 +140,136 @@ def run_batch_detection():
     return all_results
 
 
+def prefetch_images(image_paths, readers=READERS, depth=READERS * STREAM_BATCH, read=None):
+    """
+    按顺序产出(路径, 图片), 线程池最多提前解码depth张, 避免一次性读入全部图片
+    read为空时用cv2.imread解码, 否则由read(path)返回图片
+    """
+    read = read or (lambda path: cv2.imread(str(path)))
+    with ThreadPoolExecutor(max_workers=readers) as pool:
+        pending = deque()
+        paths = iter(image_paths)
+        for path in paths:
+            pending.append((path, pool.submit(read, path)))
+            if len(pending) >= depth:
+                break
+        while pending:
+            path, future = pending.popleft()
+            next_path = next(paths, None)
+            if next_path is not None:
+                pending.append((next_path, pool.submit(read, next_path)))
+            yield path, future.result()
+
+
+class AnnotatedWriter:
+    """后台线程绘制并保存标注图片, 不阻塞推理"""
+
+    def __init__(self, output_dir, max_pending=64):
+        self.output_dir = Path(output_dir)
+        self.queue = queue.Queue(maxsize=max_pending)
+        self.thread = threading.Thread(target=self._loop, daemon=True)
+        self.thread.start()
+
+    def put(self, image_path, result):
+        self.queue.put((image_path, result))
+
+    def _loop(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+            image_path, result = item
+            try:
+                cv2.imwrite(str(self.output_dir / Path(image_path).name), result.plot())
+            except Exception as e:
+                print(f"❌ 保存 {Path(image_path).name} 时出错: {str(e)}")
+
+    def close(self):
+        """等待剩余图片写入完成"""
+        self.queue.put(None)
+        self.thread.join()
+
+
+def run_stream_detection():
+    """流式批量处理输入文件夹中的所有图片, 结果随完成逐行写入RESULTS_FILE"""
+    input_path = Path(INPUT_FOLDER)
+    if not input_path.exists():
+        raise FileNotFoundError(f"输入文件夹不存在: {input_path.absolute()}")
+    output_path = Path(OUTPUT_FOLDER)
+    output_path.mkdir(parents=True, exist_ok=True)
+
+    model = validate_model(WEIGHT)
+    image_paths = sorted(p for ext in ('*.jpg', '*.jpeg', '*.png', '*.bmp') for p in input_path.glob(ext))
+    if not image_paths:
+        print("⚠️ 输入文件夹中没有找到支持的图片格式(.jpg/.jpeg/.png/.bmp)")
+        return
+    print(f"\n🔍 发现 {len(image_paths)} 张待处理图片, 批大小 {STREAM_BATCH}, 读取线程 {READERS}")
+
+    # 预解码缓存命中的图片直接取内存映射切片(已按STREAM_IMGSZ等比缩放), 其余图片照常解码
+    dataset = DatasetCache.open(SPLIT)
+    cached = {path for path in image_paths
+              if dataset is not None and dataset.has(path.stem, STREAM_IMGSZ, path)}
+    if cached:
+        print(f"📦 {len(cached)} 张图片读取自预解码缓存")
+
+    def read(path):
+        return dataset.image(path.stem, STREAM_IMGSZ) if path in cached else cv2.imread(str(path))
+
+    writer = AnnotatedWriter(output_path) if SAVE_IMAGES else None
+    done, failed = 0, 0
+    start_time = time.time()
+
+    def flush(batch, out):
+        """推理一批图片并写出结果"""
+        results = model.predict(
+            source=[img for _, img in batch],
+            conf=0.4,
+            iou=0.45,
+            imgsz=STREAM_IMGSZ,
+            device=DEVICE,
+            verbose=False,
+        )
+        for (path, _), result in zip(batch, results):
+            to_original = (lambda xyxy, stem=path.stem: dataset.to_original(stem, STREAM_IMGSZ, xyxy)) \
+                if path in cached else None
+            info = detection_info(model, path, result, to_original)
+            out.write(json.dumps(info, ensure_ascii=False) + "\n")
+            if writer:
+                writer.put(path, result)
+        out.flush()
+
+    with open(RESULTS_FILE, 'w', encoding='utf-8') as out:
+        batch = []
+        for path, img in prefetch_images(image_paths, read=read):
+            if img is None:
+                failed += 1
+                out.write(json.dumps({'image_name': path.name, 'error': '无法读取图片'}, ensure_ascii=False) + "\n")
+                continue
+            batch.append((path, img))
+            if len(batch) == STREAM_BATCH:
+                flush(batch, out)
+                done += len(batch)
+                batch = []
+                elapsed = time.time() - start_time
+                print(f"[{done + failed}/{len(image_paths)}] {done / elapsed:.1f} 张/秒")
+        if batch:
+            flush(batch, out)
+            done += len(batch)
+    if writer:
+        writer.close()
+
+    total_time = time.time() - start_time
+    print("\n=== 处理完成 ===")
+    print(f"📊 共处理 {done} 张图片, 读取失败 {failed} 张")
+    print(f"⏱️ 总耗时: {total_time:.2f} 秒, 平均每张: {total_time / max(done, 1):.3f} 秒")
+    print(f"📁 检测结果已写入: {Path(RESULTS_FILE).absolute()}")
+
+
 if __name__ == "__main__":
     try:
-        run_batch_detection()
+        if STREAM:
+            run_stream_detection()
+        else:
+            run_batch_detection()
     except Exception as e:
         print(f"❌ 程序运行失败: {str(e)}")
@@ -2,6 +2,7 @@ from flask import Blueprint, request
 
 from ocr.post import *
 from ocr.bee import bee
+from process.encoding import to_png
 
 """
 ocr.py 定义ocr相关接口
@@ -12,10 +13,10 @@ bp = Blueprint('orc', __name__)
 
 @bp.post("/ocr/bee")
 def ocr():
-    # 获取图片的base64数组
+    # 获取图片的base64数组, /process输出的tiff/packbits转为OCR服务可识别的png
     images = request.json.get("images")
-    titles = [img["image"] for img in images if img["class"] == 0]
-    contents = [img["image"] for img in images if img["class"] == 1]
+    titles = [to_png(img["image"]) for img in images if img["class"] == 0]
+    contents = [to_png(img["image"]) for img in images if img["class"] == 1]
     title = convert_punctuation_to_chinese(bee(titles))
     content = convert_punctuation_to_chinese(bee(contents))
     print(title)
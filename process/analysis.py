@@ -0,0 +1,234 @@
+from dataclasses import dataclass, asdict, replace
+
+import cv2
+import numpy as np
+
+from process.process_utils import Workspace, color_mask
+
+"""
+analysis.py 处理前的快速分析
+在缩小的图片上估计字符大小(格子边长), 统计异色批注占比与光照不均程度, 在原图的少量分块上统计细小噪点密度与清晰度,
+据此决定process_core执行哪些步骤以及使用的参数, 没有批注、噪点少或光照均匀的图片跳过对应的步骤
+字符大于TARGET_CHAR的图片先缩小到字符高度为TARGET_CHAR, 处理耗时取决于文字的多少而不是相机的像素,
+邻域、面积与形态学核等参数按缩放后的字符大小相对REFERENCE_CHAR等比调整
+"""
+
+ANALYSIS_SIZE = 512  # 分析用缩小图的长边(像素), 按整数倍缩小
+REFERENCE_CHAR = 144  # process_core的默认参数所对应的字符高度(像素), 即1200万像素作文照片上的格子边长
+TARGET_CHAR = 64  # 缩放后的字符高度, 为None时不缩放
+MIN_GRID_PEAK = 0.5  # 投影自相关的峰值低于该值时视为没有格子, 改用连通域高度估计字符大小
+HARMONIC_PEAK = 0.6  # 周期的1/2、1/3处的峰值不低于最高峰的该比例时, 认为选到的是格子边长的整数倍
+# 连通域估计可信的条件: 文字状连通域不少于MIN_CHARS个, 且估计的字符高度在缩小图上不小于MIN_CHAR_HEIGHT像素
+# 不可信时字符大小记为0, 不缩放并使用默认参数
+MIN_CHARS = 20
+MIN_CHAR_HEIGHT = 6
+CHAR_FILL = 0.75  # 连通域高度的90分位与格子边长之比, 在样例照片上统计得到, 用于换算为REFERENCE_CHAR的口径
+MIN_INK = 1e-4  # 异色批注像素占比低于该值时跳过批注去除
+UNIFORM_LIGHT = 0.05  # 背景亮度的变异系数低于该值视为光照均匀, 改用全局阈值
+BACKGROUND_KERNEL = np.ones((7, 7), np.uint8)  # 在缩小图上去除文字的膨胀核
+NOISE_PATCH = 256  # 统计噪点的原图分块边长
+NOISE_PATCHES = (0.3, 0.7)  # 分块中心在图片上的相对位置(行列各取)
+LOW_NOISE = 5000  # 每百万像素的细小连通域少于该值时跳过第一次连通域过滤
+HIGH_NOISE = 20000  # 每百万像素的细小连通域多于该值时提高自适应阈值的常数
+NOISY_C = 8  # 噪点多时自适应阈值使用的常数
+DEBLUR = True  # 是否对模糊的图片做维纳去模糊
+BLUR_VARIANCE = 120  # 缩放后分块拉普拉斯方差的最大值低于该值视为模糊, 约为高斯模糊标准差1.2像素
+# 由拉普拉斯方差估计高斯模糊的标准差(缩放后的像素): sigma = ln(SHARP_VARIANCE / 方差) / 2
+# 在样例照片上叠加不同程度的高斯模糊拟合得到, 结果按DEBLUR_STEP取整, 同尺寸图片可复用PSF频谱
+SHARP_VARIANCE = 1200
+DEBLUR_STEP = 0.25
+MAX_DEBLUR = 3.0
+
+
+@dataclass(frozen=True)
+class Plan:
+    """
+    Plan 单张图片的处理计划
+    threshold为None时使用自适应阈值, 否则使用该全局阈值(缩小图上的Otsu阈值)
+    scale为处理前的缩放比例, block/min_area/open_size/close_size为缩放后使用的参数
+    """
+    color_clean: bool
+    threshold: 'int | None'
+    adaptive_c: int
+    denoise: bool  # 形态学处理前的第一次连通域过滤
+    scale: float
+    block: int  # 自适应阈值的邻域大小
+    min_area: int  # 连通域过滤的最小面积
+    open_size: int  # 开运算核的边长
+    close_size: int  # 闭运算核的边长
+    deblur: float = 0.0  # 维纳去模糊的高斯PSF标准差, 为0时不去模糊
+    # 分析得到的指标
+    char_size: float = 0.0
+    ink: float = 0.0
+    illumination: float = 0.0
+    noise: float = 0.0
+    sharpness: float = 0.0
+
+    def key(self) -> str:
+        """不含指标的计划描述, 用于按计划分类统计"""
+        return (f"clean={int(self.color_clean)} "
+                f"threshold={'adaptive' if self.threshold is None else 'global'} "
+                f"c={self.adaptive_c} denoise={int(self.denoise)} scaled={int(self.scale != 1)} deblur={self.deblur}")
+
+    def to_dict(self) -> dict:
+        return asdict(self)
+
+    def halo(self) -> int:
+        """
+        分块处理时需要向外重叠的像素, 覆盖二值化各步骤的影响范围, 保证分块结果与整图处理一致:
+        自适应二值化邻域半径 + 开运算与闭运算(腐蚀、膨胀各核长//2) + 两次连通域过滤各min_area
+        面积小于min_area的连通域不会延伸超过min_area像素, 距分块边缘min_area以上的像素其连通域面积是否达标在分块内即可判定
+        """
+        return self.block // 2 + 2 * (self.open_size // 2) + 2 * (self.close_size // 2) + 2 * self.min_area
+
+
+def scale_params(plan: Plan, char: float) -> Plan:
+    """按字符高度char相对REFERENCE_CHAR的比例调整plan(默认参数)的邻域、面积与核"""
+    k = char / REFERENCE_CHAR
+    return replace(plan,
+                   block=max(3, int(round(plan.block * k)) | 1),
+                   min_area=max(1, int(round(plan.min_area * k * k))),
+                   open_size=max(1, int(round(plan.open_size * k))),
+                   close_size=max(1, int(round(plan.close_size * k))))
+
+
+def downsample(img: np.ndarray, size: int = ANALYSIS_SIZE) -> np.ndarray:
+    """按整数倍缩小到长边约为size, 整数倍时INTER_AREA走快速路径"""
+    h, w = img.shape[:2]
+    factor = max(1, max(h, w) // size)
+    if factor == 1:
+        return img
+    return cv2.resize(img, (w // factor, h // factor), interpolation=cv2.INTER_AREA)
+
+
+def grid_period(binary: np.ndarray):
+    """
+    行、列投影自相关的周期, 返回(周期, 峰值), 作文纸的格子边长即字符大小
+    投影先减去滑动平均去除光照等低频变化; 取峰值不低于最高峰90%的最小局部极大值, 避免选到周期的整数倍
+    长度不到长边一半的方向不参与计算
+    """
+    best = (0, 0.0)
+    for axis in (0, 1):
+        profile = binary.sum(axis=axis, dtype=np.float64)
+        n = len(profile)
+        # 条状图片的短边只容纳一两个格子, 其投影的自相关反映的是笔画而不是格子, 只使用足够长的方向
+        if n < 16 or n < max(binary.shape) / 2:
+            continue
+        window = max(3, n // 16) | 1
+        profile -= np.convolve(profile, np.ones(window) / window, "same")
+        if not profile.any():
+            continue
+        # 按重叠长度归一化的自相关
+        corr = np.correlate(profile, profile, "full")[n - 1:] / np.arange(n, 0, -1)
+        corr /= corr[0]
+        lags = corr[4:n // 3]
+        if lags.size < 3:
+            continue
+        inner = lags[1:-1]
+        peaks = np.flatnonzero((inner >= lags[:-2]) & (inner >= lags[2:]) & (inner > 0)) + 1
+        if not peaks.size:
+            continue
+        peak = float(lags[peaks].max())
+        period = 4 + int(peaks[lags[peaks] >= 0.9 * peak][0])
+        # 选到周期的整数倍时, 其1/2、1/3处也有明显的峰, 改用该处的周期
+        for k in (3, 2):
+            near = peaks[np.abs(peaks + 4 - period / k) <= 1]
+            if near.size and lags[near].max() >= HARMONIC_PEAK * peak:
+                period = 4 + int(near[lags[near].argmax()])
+                break
+        if peak > best[1]:
+            best = (period, peak)
+    return best
+
+
+def char_size(gray: np.ndarray) -> float:
+    """
+    估计缩小图上的字符高度(像素), 优先使用格子边长, 没有格子时由文字状连通域高度的90分位换算, 估计不可信时返回0
+    连通域高度的上限按长边计算, 标题等条状切割图的短边只有一两行字, 按短边计算会滤掉真正的文字;
+    同时不超过图片高度, 排除贯穿整张图片的格线
+    """
+    binary = cv2.adaptiveThreshold(gray, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY_INV, 15, 10)
+    period, peak = grid_period(binary)
+    if peak >= MIN_GRID_PEAK:
+        return float(period)
+    _, _, stats, _ = cv2.connectedComponentsWithStats(binary, connectivity=8)
+    heights = stats[1:, cv2.CC_STAT_HEIGHT]
+    heights = heights[(heights >= 3) & (heights < min(gray.shape[0], max(gray.shape) / 8))]
+    if heights.size < MIN_CHARS:
+        return 0.0
+    size = float(np.percentile(heights, 90))
+    return size / CHAR_FILL if size >= MIN_CHAR_HEIGHT else 0.0
+
+
+def illumination(gray: np.ndarray):
+    """膨胀去除文字后以中值滤波估计背景, 返回背景亮度的变异系数"""
+    background = cv2.medianBlur(cv2.dilate(gray, BACKGROUND_KERNEL), 21)
+    return float(background.std() / max(float(background.mean()), 1.0))
+
+
+def patch_stats(img: np.ndarray, plan: Plan):
+    """
+    在缩放后图片的少量分块上统计噪点密度与清晰度, 分块从原图上截取后缩放, 不缩放整张图片
+    噪点密度为按plan的参数二值化后面积小于min_area的连通域数量, 按REFERENCE_CHAR下的每百万像素计, 与缩放比例无关
+    清晰度为各分块拉普拉斯方差的最大值, 取最大值避免空白分块被误判为模糊
+    """
+    h, w = img.shape[:2]
+    size = int(round(NOISE_PATCH / plan.scale))
+    count = pixels = 0
+    sharpness = 0.0
+    for fy in NOISE_PATCHES:
+        for fx in NOISE_PATCHES:
+            y = min(max(0, int(h * fy) - size // 2), max(0, h - size))
+            x = min(max(0, int(w * fx) - size // 2), max(0, w - size))
+            patch = img[y:y + size, x:x + size]
+            if plan.scale != 1:
+                patch = cv2.resize(patch, None, fx=plan.scale, fy=plan.scale, interpolation=cv2.INTER_AREA)
+            gray = cv2.cvtColor(patch, cv2.COLOR_BGR2GRAY)
+            sharpness = max(sharpness, float(cv2.Laplacian(gray, cv2.CV_32F).var()))
+            binary = cv2.adaptiveThreshold(gray, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY_INV,
+                                           plan.block, plan.adaptive_c)
+            _, _, stats, _ = cv2.connectedComponentsWithStats(binary, connectivity=8)
+            count += int(np.count_nonzero(stats[1:, cv2.CC_STAT_AREA] < plan.min_area))
+            pixels += gray.size
+    # 缩放后同一页面的像素数按(缩放后字符/REFERENCE_CHAR)^2减少
+    ratio = plan.char_size * plan.scale / REFERENCE_CHAR if plan.char_size else 1.0
+    return count / max(pixels, 1) * 1e6 * ratio * ratio, sharpness
+
+
+def blur_sigma(sharpness: float) -> float:
+    """由清晰度估计高斯模糊的标准差, 按DEBLUR_STEP取整"""
+    sigma = np.log(SHARP_VARIANCE / max(sharpness, 1.0)) / 2
+    return float(np.clip(np.round(sigma / DEBLUR_STEP) * DEBLUR_STEP, DEBLUR_STEP, MAX_DEBLUR))
+
+
+def analyze(img: np.ndarray, base: Plan) -> Plan:
+    """分析图片并在base(默认参数的完整处理计划)的基础上决定缩放比例、跳过的步骤与参数"""
+    small = downsample(img)
+    factor = img.shape[0] / small.shape[0]
+    # 缩小图使用单独的缓冲区, 不替换当前线程中原图尺寸的缓冲区
+    ink = np.count_nonzero(color_mask(small, Workspace())) / (small.shape[0] * small.shape[1])
+    gray = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+    char = char_size(gray) * factor
+    light = illumination(gray)
+
+    plan = replace(base, char_size=char, ink=float(ink), illumination=light)
+    # 字符大小不可信(为0)时不缩放, 使用默认参数
+    if char > 0:
+        if TARGET_CHAR and char > TARGET_CHAR:
+            plan = replace(plan, scale=TARGET_CHAR / char)
+        plan = scale_params(plan, char * plan.scale)
+    noise, sharpness = patch_stats(img, plan)
+    plan = replace(plan, noise=noise, sharpness=sharpness)
+    if DEBLUR and sharpness < BLUR_VARIANCE:
+        plan = replace(plan, deblur=blur_sigma(sharpness))
+
+    if ink < MIN_INK:
+        plan = replace(plan, color_clean=False)
+    if light < UNIFORM_LIGHT:
+        threshold, _ = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY | cv2.THRESH_OTSU)
+        plan = replace(plan, threshold=int(threshold))
+    if plan.noise < LOW_NOISE:
+        plan = replace(plan, denoise=False)
+    elif plan.noise > HIGH_NOISE:
+        plan = replace(plan, adaptive_c=max(base.adaptive_c, NOISY_C))
+    return plan
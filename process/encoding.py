@@ -0,0 +1,82 @@
+import base64
+import io
+
+import cv2
+import numpy as np
+from PIL import Image
+
+"""
+encoding.py 处理结果的编码与解码
+process_core的输出只有黑白两种像素, 除原有的jpg外提供三种二值图编码:
+    png         1位深PNG
+    tiff        CCITT Group 4压缩的1位深TIFF
+    packbits    np.packbits按行打包的位图(每字节8个像素, 高位在前, 1为白), 附带图片尺寸
+jpg/png/tiff编码为base64字符串, packbits编码为{"data": base64字符串, "shape": [h, w]}
+"""
+
+FORMATS = ("jpg", "png", "tiff", "packbits")
+DEFAULT_FORMAT = "jpg"
+
+
+def pack(img: np.ndarray) -> bytes:
+    """按行打包二值图, 非0像素为1"""
+    return np.packbits(img, axis=1).tobytes()
+
+
+def unpack(data: bytes, shape) -> np.ndarray:
+    """pack的逆过程, 返回0/255的灰度图"""
+    h, w = shape
+    bits = np.frombuffer(data, np.uint8).reshape(h, (w + 7) // 8)
+    return np.unpackbits(bits, axis=1, count=w) * np.uint8(255)
+
+
+def encode_bytes(img: np.ndarray, fmt: str = DEFAULT_FORMAT) -> bytes:
+    """将二值图编码为fmt格式的字节串"""
+    if fmt == "jpg":
+        return cv2.imencode('.jpg', img)[1].tobytes()
+    if fmt == "png":
+        return cv2.imencode('.png', img, [cv2.IMWRITE_PNG_BILEVEL, 1])[1].tobytes()
+    if fmt == "tiff":
+        # PIL的"1"模式与np.packbits的按行打包方式相同, 直接由位图构造, 不经过convert的抖动
+        h, w = img.shape[:2]
+        buffer = io.BytesIO()
+        Image.frombytes("1", (w, h), pack(img)).save(buffer, "TIFF", compression="group4")
+        return buffer.getvalue()
+    if fmt == "packbits":
+        return pack(img)
+    raise ValueError(f"不支持的编码格式: {fmt}")
+
+
+def encode(img: np.ndarray, fmt: str = DEFAULT_FORMAT):
+    """将二值图编码为可JSON序列化的结果"""
+    data = base64.b64encode(encode_bytes(img, fmt)).decode('utf-8')
+    if fmt == "packbits":
+        return {"data": data, "shape": list(img.shape[:2])}
+    return data
+
+
+def decode(item) -> np.ndarray:
+    """
+    解码encode的结果(或任意base64编码的图片)为灰度图
+    jpg/png由OpenCV解码, OpenCV无法解码的CCITT G4 TIFF回退到PIL
+    """
+    if isinstance(item, dict):
+        return unpack(base64.b64decode(item["data"]), item["shape"])
+    data = base64.b64decode(item.split(',')[-1])
+    img = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_GRAYSCALE)
+    if img is None:
+        with Image.open(io.BytesIO(data)) as pil:
+            img = np.asarray(pil.convert("L"))
+    return img
+
+
+def to_png(item) -> str:
+    """
+    转为base64编码的1位深PNG, 供只接受常见图片格式的下游(OCR服务、浏览器)使用
+    jpg与png原样返回
+    """
+    if isinstance(item, str):
+        head = base64.b64decode(item.split(',')[-1][:8])
+        if head.startswith(b"\x89PNG") or head.startswith(b"\xff\xd8"):
+            return item
+    return encode(decode(item), "png")
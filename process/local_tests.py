@@ -1,9 +1,21 @@
 # 单张处理本地文件
+import ast
+import hashlib
+import json
 import os
+import sys
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
 from glob import glob
+from pathlib import Path
+
+import time
 
 import cv2
+import numpy as np
 
+from process import processor
+from process.encoding import FORMATS, decode, encode
+from process.process_utils import color_clean, color_mask, inpaint_radius
 from process.processor import process_core
 
 
@@ -30,6 +42,182 @@ def process_locals(input_folder, output_folder):
         print(f"已处理: {input_path.replace(os.sep, '/')} -> {output_path.replace(os.sep, '/')}")
 
 
+# 批量模式的输入图片后缀与清单文件名
+BULK_SUFFIXES = ('.jpg', '.jpeg', '.png')
+MANIFEST = "manifest.json"
+# 处理多少张图片后保存一次清单, 中断后重新运行时从清单继续
+MANIFEST_EVERY = 100
+
+
+def pipeline_modules(module="process.processor"):
+    """
+    process_core所在模块及其递归导入的process包内模块的源码路径(排序后)
+    按源码中的import语句静态解析, 结果与导入顺序无关; 本文件与未被导入的模块(如restore/degradation.py)不在其中
+    """
+    root = Path(__file__).parent.parent
+    seen, todo = set(), [module]
+    while todo:
+        name = todo.pop()
+        path = root / f"{name.replace('.', '/')}.py"
+        if name in seen or not path.exists():
+            continue
+        seen.add(name)
+        for node in ast.walk(ast.parse(path.read_bytes())):
+            if isinstance(node, ast.ImportFrom) and node.module == "process":
+                todo.extend(f"process.{alias.name}" for alias in node.names)
+            elif isinstance(node, ast.ImportFrom) and (node.module or "").startswith("process."):
+                todo.append(node.module)
+            elif isinstance(node, ast.Import):
+                todo.extend(alias.name for alias in node.names if alias.name.startswith("process."))
+    return sorted(root / f"{name.replace('.', '/')}.py" for name in seen)
+
+
+def pipeline_version():
+    """
+    处理流程源码的哈希, process_core及其导入的模块改变后所有输出都视为过期
+    连同相对路径一起哈希, 导入的模块增减同样使版本改变
+    """
+    root = Path(__file__).parent.parent
+    digest = hashlib.sha1()
+    for path in pipeline_modules():
+        digest.update(path.relative_to(root).as_posix().encode())
+        digest.update(path.read_bytes())
+    return digest.hexdigest()
+
+
+def bulk_init():
+    # 进程间已经并行, 每个进程内的OpenCV只使用一个线程, 分块也在单个线程中依次处理, 避免线程数超过核数
+    cv2.setNumThreads(1)
+    processor.tile_executor.shutdown()
+    processor.tile_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="process-tile")
+
+
+def bulk_task(input_path, output_path, known_hash):
+    """
+    子进程中处理单张图片, 返回(输入哈希, 是否实际处理)
+    输入哈希与清单中的一致且输出存在时只返回哈希, 不重新处理
+    """
+    data = Path(input_path).read_bytes()
+    digest = hashlib.sha1(data).hexdigest()
+    if digest == known_hash and os.path.exists(output_path):
+        return digest, False
+    img = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
+    if img is None:
+        raise ValueError("无法解码图片")
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    if not cv2.imwrite(output_path, process_core(img)):
+        raise ValueError("无法写入输出")
+    return digest, True
+
+
+def save_manifest(path, manifest):
+    # 先写临时文件再替换, 中断时不会留下损坏的清单
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False)
+    os.replace(tmp, path)
+
+
+# 并行、可续跑的批量处理: 递归查找输入文件夹中的图片, 按相对路径输出到output_folder
+# output_folder下的清单记录每张图片的哈希, 重新运行时跳过哈希与处理流程均未变化且输出存在的图片
+def process_bulk(input_folder, output_folder, workers=None):
+    input_root, output_root = Path(input_folder), Path(output_folder)
+    output_root.mkdir(parents=True, exist_ok=True)
+    manifest_path = output_root / MANIFEST
+    version = pipeline_version()
+    manifest = {"version": version, "files": {}}
+    if manifest_path.exists():
+        previous = json.loads(manifest_path.read_text(encoding="utf-8"))
+        # 处理流程改变时清单中的记录全部作废
+        if previous.get("version") == version:
+            manifest = previous
+    files = manifest["files"]
+
+    image_files = sorted(p for p in input_root.rglob('*') if p.suffix.lower() in BULK_SUFFIXES and p.is_file())
+    tasks, skipped = [], 0
+    for input_path in image_files:
+        rel = input_path.relative_to(input_root).as_posix()
+        output_path = output_root / input_path.parent.relative_to(input_root) / f"processed_{input_path.name}"
+        stat = input_path.stat()
+        entry = files.get(rel)
+        # 大小与修改时间都未变化时不读取文件, 直接跳过
+        if entry and entry["size"] == stat.st_size and entry["mtime"] == stat.st_mtime_ns and output_path.exists():
+            skipped += 1
+            continue
+        tasks.append((rel, str(input_path), str(output_path), stat, entry["hash"] if entry else None))
+
+    total = len(tasks)
+    print(f"共 {len(image_files)} 张图片, 跳过 {skipped} 张未变化的图片, 待处理 {total} 张")
+    if not total:
+        return
+
+    done = processed = failed = 0
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count() or 1, initializer=bulk_init) as pool:
+        futures = {pool.submit(bulk_task, input_path, output_path, known): (rel, stat)
+                   for rel, input_path, output_path, stat, known in tasks}
+        for future in as_completed(futures):
+            rel, stat = futures[future]
+            done += 1
+            try:
+                digest, changed = future.result()
+                files[rel] = {"hash": digest, "size": stat.st_size, "mtime": stat.st_mtime_ns}
+                processed += changed
+            except Exception as e:
+                failed += 1
+                print(f"\n处理失败: {rel} {e}")
+            if done % MANIFEST_EVERY == 0:
+                save_manifest(manifest_path, manifest)
+            elapsed = time.perf_counter() - start
+            rate = done / elapsed
+            sys.stdout.write(f"\r{done}/{total} | {rate:.1f} 张/秒 | 已用 {elapsed:.0f}s | 剩余 {(total - done) / rate:.0f}s")
+            sys.stdout.flush()
+    save_manifest(manifest_path, manifest)
+    print(f"\n完成: 处理 {processed} 张, 内容未变化 {done - processed - failed} 张, 失败 {failed} 张, "
+          f"耗时 {time.perf_counter() - start:.1f}s")
+
+
+# 对比整图修复与按区域修复/缩小修复的耗时, 以及与整图修复结果的差异
+def benchmark_color_clean(image_paths, scales=(1.0, 0.5), repeat=3):
+    def best_time(fn):
+        times = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            out = fn()
+            times.append(time.perf_counter() - start)
+        return min(times), out
+
+    for path in image_paths:
+        img = cv2.imread(path)
+        full_time, full = best_time(
+            lambda: cv2.inpaint(img, color_mask(img), inpaintRadius=inpaint_radius, flags=cv2.INPAINT_TELEA))
+        line = f"{os.path.basename(path)} 掩码占比 {np.count_nonzero(color_mask(img)) / img[..., 0].size:.2%} | " \
+               f"整图 {full_time * 1000:.0f}ms"
+        for scale in scales:
+            roi_time, out = best_time(lambda: color_clean(img, scale))
+            line += f" | 区域x{scale} {roi_time * 1000:.0f}ms 平均差异 {np.abs(out.astype(int) - full).mean():.3f}"
+        print(line)
+
+
+# 对比各输出编码的base64体积、编码/解码耗时, 以及解码结果与处理结果不同的像素数
+def benchmark_encoding(image_paths, repeat=3):
+    for path in image_paths:
+        output = process_core(cv2.imread(path))
+        print(f"{os.path.basename(path)} {output.shape[1]}x{output.shape[0]}")
+        for fmt in FORMATS:
+            encode_time = decode_time = float("inf")
+            for _ in range(repeat):
+                start = time.perf_counter()
+                encoded = encode(output, fmt)
+                encode_time = min(encode_time, time.perf_counter() - start)
+                start = time.perf_counter()
+                decoded = decode(encoded)
+                decode_time = min(decode_time, time.perf_counter() - start)
+            size = len(encoded["data"] if isinstance(encoded, dict) else encoded)
+            print(f"  {fmt:<8} {size / 1024:8.0f}KB | 编码 {encode_time * 1000:5.1f}ms | 解码 {decode_time * 1000:5.1f}ms"
+                  f" | 差异像素 {np.count_nonzero(decoded != output)}")
+
+
 # 本地测试用
 if __name__ == "__main__":
     input_image = "../asset/process/0377ac35a913fe307f9e9118398c587.jpg"  # 输入图片路径
@@ -39,3 +227,7 @@ if __name__ == "__main__":
     # input_folder = r"../locate/resource/dataset/train/images"  # 输入文件夹路径
     # output_folder = r"../asset/processed"  # 输出文件夹路径
     # process_locals(input_folder, output_folder)
+    # process_bulk(input_folder, output_folder)  # 并行、可续跑的批量处理(递归查找子文件夹)
+
+    # benchmark_color_clean(glob("../asset/*.jpg"))
+    # benchmark_encoding(glob("../asset/*.jpg"))
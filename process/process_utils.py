@@ -1,3 +1,5 @@
+import threading
+
 import cv2
 import numpy as np
 
@@ -14,15 +16,100 @@ lower_blue = np.array([100, 50, 50])
 upper_blue = np.array([140, 255, 255])
 
 
-def color_clean(img):
+# 连通域过滤时每次查表的行数
+lut_rows = 256
+
+# 修复半径
+inpaint_radius = 3
+# 修复区域在掩码连通域外接矩形基础上向外扩展的像素, 需覆盖TELEA算法的邻域
+inpaint_margin = 2 * inpaint_radius + 1
+inpaint_kernel = np.ones((2 * inpaint_margin + 1, 2 * inpaint_margin + 1), np.uint8)
+# 修复区域数超过该值, 或区域面积之和超过图片面积的该比例时, 改为整图修复一次
+inpaint_max_regions = 500
+inpaint_max_cover = 0.5
+# 修复时的缩放比例, 小于1时在缩小的区域上修复, 再将结果放大写回掩码像素
+inpaint_scale = 1.0
+
+
+class Workspace:
+    """
+    Workspace 预分配缓冲区
+    按名称复用同尺寸的数组, 处理同尺寸的图片时不再重复申请内存, 尺寸变化时重新分配
+    """
+
+    def __init__(self):
+        self.buffers = {}
+
+    def get(self, name, shape, dtype=np.uint8):
+        buffer = self.buffers.get(name)
+        if buffer is None or buffer.shape != shape or buffer.dtype != dtype:
+            buffer = self.buffers[name] = np.empty(shape, dtype)
+        return buffer
+
+
+_local = threading.local()
+
+
+def workspace():
+    """当前线程的缓冲区, 线程之间互不共享"""
+    if not hasattr(_local, "workspace"):
+        _local.workspace = Workspace()
+    return _local.workspace
+
+
+def color_mask(img, ws=None):
+    """红色和蓝色区域的掩码, 返回ws(为空时为当前线程的缓冲区)中的数组, 下次调用时会被覆盖"""
+    ws = ws or workspace()
+    shape = img.shape[:2]
     # 转换为HSV颜色空间(色相, 亮度, 纯度)
-    hsv = cv2.cvtColor(img, cv2.COLOR_BGR2HSV)
+    hsv = cv2.cvtColor(img, cv2.COLOR_BGR2HSV, dst=ws.get("hsv", img.shape))
 
     # 创建红色和蓝色mask, mask范围内设置为白色, 否则黑色
-    mask_red = cv2.bitwise_or(cv2.inRange(hsv, lower_red1, upper_red1), cv2.inRange(hsv, lower_red2, upper_red2))
-    mask_blue = cv2.inRange(hsv, lower_blue, upper_blue)
+    mask = cv2.inRange(hsv, lower_red1, upper_red1, dst=ws.get("mask", shape))
+    part = ws.get("mask_part", shape)
+    cv2.bitwise_or(mask, cv2.inRange(hsv, lower_red2, upper_red2, dst=part), dst=mask)
     # 合并红色和蓝色
-    mask_combined = cv2.bitwise_or(mask_red, mask_blue)
+    return cv2.bitwise_or(mask, cv2.inRange(hsv, lower_blue, upper_blue, dst=part), dst=mask)
+
+
+def inpaint_regions(mask):
+    """
+    将掩码膨胀inpaint_margin后取连通域, 膨胀同时完成向外扩展与相邻区域的合并
+    返回(标签图, [(标签, x, y, w, h)]), 外接矩形已包含TELEA所需的邻域; 标签图为当前线程缓冲区中的数组
+    不同连通域的掩码像素相距超过inpaint_margin, 修复时互不影响
+    """
+    ws = workspace()
+    dilated = cv2.dilate(mask, inpaint_kernel, dst=ws.get("inpaint_dilated", mask.shape))
+    labels = ws.get("labels", mask.shape, np.int32)
+    n, labels, stats, _ = cv2.connectedComponentsWithStats(dilated, labels=labels, connectivity=8)
+    return labels, [(i, *stats[i, :4]) for i in range(1, n)]
+
+
+def inpaint_roi(roi, mask, scale):
+    """修复单个区域, scale小于1时在缩小的区域上修复后放大, 只写回掩码像素"""
+    if scale >= 1:
+        filled = cv2.inpaint(roi, mask, inpaintRadius=inpaint_radius, flags=cv2.INPAINT_TELEA)
+    else:
+        h, w = mask.shape
+        small_w, small_h = max(1, round(w * scale)), max(1, round(h * scale))
+        small = cv2.resize(roi, (small_w, small_h), interpolation=cv2.INTER_AREA)
+        # 缩小后只要覆盖到任意掩码像素即视为待修复
+        small_mask = cv2.resize(mask, (small_w, small_h), interpolation=cv2.INTER_AREA)
+        small_mask[small_mask > 0] = 255
+        small = cv2.inpaint(small, small_mask, inpaintRadius=max(1, round(inpaint_radius * scale)),
+                            flags=cv2.INPAINT_TELEA)
+        filled = cv2.resize(small, (w, h), interpolation=cv2.INTER_LINEAR)
+    np.copyto(roi, filled, where=mask[..., None] > 0)
+
+
+def color_clean(img, scale=inpaint_scale, dst=None):
+    """
+    去除红色和蓝色的批注, 没有批注时直接返回原图
+    只在掩码连通域扩展后的外接矩形内修复, scale小于1时在缩小的区域上修复; 结果写入dst(为空时新建)
+    """
+    mask_combined = color_mask(img)
+    if not cv2.countNonZero(mask_combined):
+        return img
 
     # 使用TELEA算法进行图像恢复, 去除红色和蓝色区域并用周围像素填充
     # TELEA算法流程:
@@ -30,11 +117,50 @@ def color_clean(img):
     #   优先级计算：基于边界法线和梯度方向计算修复优先级
     #   像素填充：从最高优先级开始，用邻域加权平均填充
     #   传播更新：更新边界和优先级，迭代处理
-    return cv2.inpaint(img, mask_combined, inpaintRadius=3, flags=cv2.INPAINT_TELEA)
+    if dst is None:
+        result = img.copy()
+    else:
+        result = dst
+        np.copyto(result, img)
+    labels, regions = inpaint_regions(mask_combined)
+    covered = sum(int(w) * int(h) for _, _, _, w, h in regions)
+    if len(regions) > inpaint_max_regions or covered > inpaint_max_cover * mask_combined.size:
+        # 噪点多或批注遍布全图时逐区域修复没有收益, 整图修复一次
+        inpaint_roi(result, mask_combined, scale)
+        return result
+    for i, x, y, w, h in regions:
+        # 只修复并写回本连通域的掩码像素, 外接矩形内其它连通域的像素距离足够远, 不参与计算
+        region_mask = mask_combined[y:y + h, x:x + w] & (labels[y:y + h, x:x + w] == i).view(np.uint8) * 255
+        inpaint_roi(result[y:y + h, x:x + w], region_mask, scale)
+    return result
+
+
+# 通过连通域去除噪声, 过滤连通区域小于阈值的噪声, 结果写入dst(为空时新建)
+def connect_clean(img, min_area, dst=None):
+    labels = workspace().get("labels", img.shape, np.int32)
+    num_labels, labels, stats, centroids = cv2.connectedComponentsWithStats(img, labels=labels, connectivity=8)
+    # 查找表: 面积达到阈值的标签映射为255, 背景与噪声映射为0
+    lut = np.zeros(num_labels, np.uint8)
+    lut[1:][stats[1:, cv2.CC_STAT_AREA] >= min_area] = 255
+    if dst is None:
+        dst = np.empty(img.shape, np.uint8)
+    # 分块查表, 标签先拷入预分配的intp缓冲区, 避免np.take整图转换索引类型时申请临时数组
+    rows = workspace().get("label_index", (lut_rows, img.shape[1]), np.intp)
+    for y in range(0, img.shape[0], lut_rows):
+        n = min(lut_rows, img.shape[0] - y)
+        np.copyto(rows[:n], labels[y:y + n])
+        np.take(lut, rows[:n], out=dst[y:y + n], mode="clip")
+    return dst
 
 
-# 通过连通域去除噪声, 过滤连通区域小于阈值的噪声
-def connect_clean(img, min_area):
-    num_labels, labels, stats, centroids = cv2.connectedComponentsWithStats(img, connectivity=8)
-    valid_labels = np.where(stats[1:, cv2.CC_STAT_AREA] >= min_area)[0] + 1
-    return np.isin(labels, valid_labels).astype(np.uint8) * 255
+def shrink(img, size, dst=None):
+    """
+    缩小到size(w, h), 先按整数倍INTER_AREA缩小(快速路径), 再缩放剩余的比例
+    中间结果写入当前线程的缓冲区, 结果写入dst(为空时新建)
+    """
+    h, w = img.shape[:2]
+    factor = min(w // size[0], h // size[1])
+    if factor >= 2:
+        middle = workspace().get("shrink", (h // factor, w // factor) + img.shape[2:])
+        img = cv2.resize(img, (w // factor, h // factor), dst=middle, interpolation=cv2.INTER_AREA)
+    return cv2.resize(img, size, dst=dst, interpolation=cv2.INTER_AREA)
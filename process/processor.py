@@ -1,5 +1,11 @@
 import base64
+import logging
 import os
+import threading
+import time
+from collections import Counter, defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 from glob import glob
 
 import cv2
@@ -7,7 +13,11 @@ import numpy as np
 from flask import Blueprint, request
 
 from common import rex
+from common.metrics import Stats
+from process.analysis import Plan, analyze
+from process.encoding import FORMATS, DEFAULT_FORMAT, encode
 from process.process_utils import *
+from process.restore.restore_freq import gaussian_psf, spectra, wiener
 
 """
 process.py 核心图片处理逻辑
@@ -15,45 +25,216 @@ process.py 核心图片处理逻辑
 
 bp = Blueprint('process', __name__)
 
+# 各请求共享的处理线程池, OpenCV在解码、处理与编码时释放GIL, 同一请求的多张图片可并行处理
+# 每个线程持有自己的预分配缓冲区, 线程数同时限制了缓冲区占用的内存
+WORKERS = min(4, os.cpu_count() or 1)
+executor = ThreadPoolExecutor(max_workers=WORKERS, thread_name_prefix="process")
 
-def process_core(img: 'Mat | ndarray[Any, dtype] | UMat'):
+
+# 自适应二值化的邻域大小与常数
+ADAPTIVE_BLOCK = 15
+ADAPTIVE_C = 5
+# 连通域过滤的最小面积
+MIN_AREA = 50
+# 开运算与闭运算核的边长
+OPEN_SIZE = 2
+CLOSE_SIZE = 3
+# 以上为字符高度为analysis.REFERENCE_CHAR时的参数, 缩放后按字符大小等比调整
+# 维纳去模糊的噪声与信号功率比
+WIENER_K = 0.01
+# 反色并保留大于文字阈值部分的查找表, 一次完成 bitwise_not 与 final[final > text_threshold] = 255
+invert_lut = 255 - np.arange(256, dtype=np.uint8)
+invert_lut[invert_lut > text_threshold] = 255
+
+# 分块处理: 像素数超过TILE_PIXELS的图片按TILE x TILE分块, 在tile_executor上并行二值化后拼接
+# 分块向外重叠的像素见Plan.halo
+TILE = 1024
+TILE_PIXELS = 16 * 1024 * 1024
+# 分块专用线程池, 与请求级的executor分开, 避免在executor内提交分块任务时互相等待
+tile_executor = ThreadPoolExecutor(max_workers=os.cpu_count() or 1, thread_name_prefix="process-tile")
+
+# 按图片分析结果选择处理步骤, 关闭时所有图片都执行完整流程(FULL_PLAN)
+ADAPTIVE_PLAN = True
+FULL_PLAN = Plan(color_clean=True, threshold=None, adaptive_c=ADAPTIVE_C, denoise=True, scale=1.0,
+                 block=ADAPTIVE_BLOCK, min_area=MIN_AREA, open_size=OPEN_SIZE, close_size=CLOSE_SIZE)
+# 处理计划与各步骤耗时的统计, 通过GET /process/metrics查看
+# threshold为自适应二值化, 光照均匀时改用的全局阈值记为global_threshold
+STEPS = ("analyze", "normalize", "color_clean", "deblur", "threshold", "global_threshold", "denoise", "morphology",
+         "filter")
+# 原处理流程中可按计划跳过的步骤, 只有这些步骤统计跳过次数与节省的时间;
+# analyze/normalize/deblur是新增的步骤, global_threshold是自适应二值化的替代, 不执行时不算跳过
+SKIPPABLE = ("color_clean", "threshold", "denoise", "morphology")
+step_time = {step: Stats() for step in STEPS}
+skipped = Counter()
+plans = Counter()
+recent_plans = deque(maxlen=100)
+_plan_lock = threading.Lock()
+
+
+class Timer:
+    """累计各步骤的耗时(秒)"""
+
+    def __init__(self):
+        self.times = defaultdict(float)
+        self._start = time.perf_counter()
+
+    def lap(self, step):
+        now = time.perf_counter()
+        self.times[step] += now - self._start
+        self._start = now
+
+
+@lru_cache(maxsize=None)
+def kernel(size):
+    """边长为size的方形结构元素"""
+    return np.ones((size, size), np.uint8)
+
+
+def binarize(img_cleaned, out=None, plan=FULL_PLAN, timer=None):
     """
-    输入参数为opencv图片，输出参数也为opencv图片
+    去除批注后的彩色图片(或去模糊后的灰度图) -> 反色后的文字二值图
+    按plan选择阈值方式与是否执行第一次连通域过滤, 各步骤耗时累计到timer
+    中间结果写入当前线程预分配的缓冲区, 结果写入out(为空时新建)
     """
-
-    img_cleaned = color_clean(img)
+    ws = workspace()
+    shape = img_cleaned.shape[:2]
+    a, b = ws.get("a", shape), ws.get("b", shape)
+    timer = timer or Timer()
 
     # 转换为灰度图 (R*77 + G*150 + B*29) >> 8
-    gray = cv2.cvtColor(img_cleaned, cv2.COLOR_BGR2GRAY)
-
-    # 自适应二值化, 根据局部区域亮度特性动态调整阈值
-    binary = cv2.adaptiveThreshold(
-        gray, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C,
-        cv2.THRESH_BINARY_INV, 15, 5
-    )
-
-    # 通过连通域去除细小噪声
-    binary = connect_clean(binary, 50)
-
-    open_kernel = np.ones((2, 2), np.uint8)
-    close_kernel = np.ones((3, 3), np.uint8)
-    # 开运算去噪
-    clean = cv2.morphologyEx(binary, cv2.MORPH_OPEN, open_kernel)
-    # 闭运算连接文字
-    clean = cv2.morphologyEx(clean, cv2.MORPH_CLOSE, close_kernel)
+    if img_cleaned.ndim == 2:
+        gray = img_cleaned
+    else:
+        gray = cv2.cvtColor(img_cleaned, cv2.COLOR_BGR2GRAY, dst=ws.get("gray", shape))
+
+    # 两个缓冲区交替作为各步骤的输入与输出, cur为当前结果
+    cur, tmp = a, b
+    if plan.threshold is None:
+        # 自适应二值化, 根据局部区域亮度特性动态调整阈值
+        cv2.adaptiveThreshold(
+            gray, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C,
+            cv2.THRESH_BINARY_INV, plan.block, plan.adaptive_c, dst=cur
+        )
+    else:
+        # 光照均匀时使用分析得到的全局阈值, 各分块使用同一阈值
+        cv2.threshold(gray, plan.threshold, 255, cv2.THRESH_BINARY_INV, dst=cur)
+    timer.lap("threshold" if plan.threshold is None else "global_threshold")
+
+    if plan.denoise:
+        # 通过连通域去除细小噪声
+        connect_clean(cur, plan.min_area, dst=tmp)
+        cur, tmp = tmp, cur
+        timer.lap("denoise")
+
+    # 核缩放到1x1时开、闭运算不改变图片, 直接跳过
+    if plan.open_size > 1:
+        # 开运算去噪(先腐蚀后膨胀)
+        cv2.erode(cur, kernel(plan.open_size), dst=tmp)
+        cv2.dilate(tmp, kernel(plan.open_size), dst=cur)
+    if plan.close_size > 1:
+        # 闭运算连接文字(先膨胀后腐蚀)
+        cv2.dilate(cur, kernel(plan.close_size), dst=tmp)
+        cv2.erode(tmp, kernel(plan.close_size), dst=cur)
+    if plan.open_size > 1 or plan.close_size > 1:
+        timer.lap("morphology")
     # 连通域过滤
-    clean = connect_clean(clean, 50)
+    clean = connect_clean(cur, plan.min_area, dst=tmp)
+
+    # 原先的"膨胀后与自身按位与"结果恒等于自身(3x3膨胀包含原像素), 直接省略
+    # 黑白像素反转, 并保留大于文字阈值的部分
+    if out is None:
+        out = np.empty(shape, np.uint8)
+    cv2.LUT(clean, invert_lut, dst=out)
+    timer.lap("filter")
+    return out
 
-    # 膨胀操作连接笔画
-    kernel = np.ones((3, 3), np.uint8)
-    reconstructed = cv2.morphologyEx(clean, cv2.MORPH_DILATE, kernel, iterations=1)
-    final_mask = cv2.bitwise_and(reconstructed, clean)
-    # 黑白像素反转
-    final = cv2.bitwise_not(final_mask)
 
-    # 保留大于文字阈值的部分
-    final[final > text_threshold] = 255
-    return final
+def binarize_tile(img_cleaned, out, y0, y1, x0, x1, plan):
+    """对包含重叠区域的分块二值化, 只将分块本身的结果写入out, 返回分块各步骤的耗时"""
+    h, w = out.shape
+    halo = plan.halo()
+    top, left = max(0, y0 - halo), max(0, x0 - halo)
+    bottom, right = min(h, y1 + halo), min(w, x1 + halo)
+    timer = Timer()
+    tile = binarize(img_cleaned[top:bottom, left:right], workspace().get("tile", (bottom - top, right - left)),
+                    plan, timer)
+    out[y0:y1, x0:x1] = tile[y0 - top:y1 - top, x0 - left:x1 - left]
+    return timer.times
+
+
+def record(plan: Plan, times: dict):
+    """记录单张图片的处理计划与各步骤耗时, 未执行的SKIPPABLE步骤计入skipped"""
+    for step in STEPS:
+        if step in times:
+            step_time[step].observe(times[step])
+    with _plan_lock:
+        for step in SKIPPABLE:
+            if step not in times:
+                skipped[step] += 1
+        plans[plan.key()] += 1
+        recent_plans.append({**plan.to_dict(), "times": dict(times)})
+
+
+def process_core(img: 'Mat | ndarray[Any, dtype] | UMat', out=None, tiled=None, plan=None):
+    """
+    输入参数为opencv图片，输出参数也为opencv图片
+    plan为空时按ADAPTIVE_PLAN分析图片决定处理计划, 计划与耗时记录到统计中
+    plan.scale不为1时先缩放到目标字符高度, 输出为缩放后的尺寸
+    结果写入out(为空时新建, 尺寸需与缩放后一致); tiled为空时按像素数自动决定是否分块并行处理
+    批注去除只修复批注所在区域, 去模糊在整图上进行, 均不分块; 其后的二值化分块执行
+    """
+    timer = Timer()
+    if plan is None:
+        plan = analyze(img, FULL_PLAN) if ADAPTIVE_PLAN else FULL_PLAN
+        timer.lap("analyze")
+    if plan.scale != 1:
+        h, w = img.shape[:2]
+        size = (max(1, round(w * plan.scale)), max(1, round(h * plan.scale)))
+        normalized = workspace().get("normalized", (size[1], size[0]) + img.shape[2:])
+        img = shrink(img, size, dst=normalized)
+        timer.lap("normalize")
+
+    shape = img.shape[:2]
+    if out is None:
+        out = np.empty(shape, np.uint8)
+    img_cleaned = img
+    if plan.color_clean:
+        img_cleaned = color_clean(img, dst=workspace().get("cleaned", img.shape))
+        timer.lap("color_clean")
+    if plan.deblur:
+        # 模糊的图片在灰度图上维纳去模糊, 不分块; 之后的二值化直接使用去模糊后的灰度图
+        gray = cv2.cvtColor(img_cleaned, cv2.COLOR_BGR2GRAY, dst=workspace().get("gray_blurred", shape))
+        img_cleaned = wiener(gray, gaussian_psf(plan.deblur), WIENER_K, dst=workspace().get("deblurred", shape))
+        timer.lap("deblur")
+    if tiled is None:
+        tiled = shape[0] * shape[1] > TILE_PIXELS
+    if not tiled:
+        binarize(img_cleaned, out, plan, timer)
+    else:
+        futures = [tile_executor.submit(binarize_tile, img_cleaned, out, y, min(y + TILE, shape[0]), x,
+                                        min(x + TILE, shape[1]), plan)
+                   for y in range(0, shape[0], TILE) for x in range(0, shape[1], TILE)]
+        # 各分块并行执行, 按步骤累计所有分块的耗时(CPU时间)
+        for future in futures:
+            for step, seconds in future.result().items():
+                timer.times[step] += seconds
+    record(plan, timer.times)
+    return out
+
+
+def process_image(base64_str, fmt=DEFAULT_FORMAT):
+    """解码单张base64图片, 处理后按fmt编码, 格式见encoding.py"""
+    # 解码base64
+    img_bytes = base64.b64decode(base64_str.split(',')[-1])
+    np_arr = np.frombuffer(img_bytes, np.uint8)
+
+    # 转换为OpenCV格式
+    img = cv2.imdecode(np_arr, cv2.IMREAD_COLOR)
+    if img is None:
+        raise ValueError("无法解码图片")
+
+    processed_img = process_core(img)
+    return encode(processed_img, fmt)
 
 
 @bp.post('/process')
@@ -62,19 +243,43 @@ def process():
         data = request.json
         if not data or 'images' not in data:
             return rex.fail(None, "no images")
-        result = []
-        for base64_str in data['images']:
-            # 解码base64
-            img_bytes = base64.b64decode(base64_str.split(',')[-1])
-            np_arr = np.frombuffer(img_bytes, np.uint8)
-
-            # 转换为OpenCV格式
-            img = cv2.imdecode(np_arr, cv2.IMREAD_COLOR)
-
-            processed_img = process_core(img)
-            # base64编码
-            _, buffer = cv2.imencode('.jpg', processed_img)
-            result.append(base64.b64encode(buffer).decode('utf-8'))
+        # 输出编码, 默认jpg; 处理结果为二值图, png/tiff/packbits体积更小且无损
+        fmt = data.get('format', DEFAULT_FORMAT)
+        if fmt not in FORMATS:
+            return rex.fail(None, msg=f"unsupported format: {fmt}")
+        # 提交到共享线程池并行处理, 按提交顺序收集结果
+        futures = [executor.submit(process_image, base64_str, fmt) for base64_str in data['images']]
+        result, errors = [], []
+        for i, future in enumerate(futures):
+            try:
+                result.append(future.result())
+            except Exception as e:
+                # 单张图片失败时该位置返回None, 不影响其它图片
+                logging.error(f"处理第{i}张图片失败 {e}")
+                result.append(None)
+                errors.append(f"[{i}] {e}")
+        if errors:
+            return rex.succeed(result, msg=f"{len(errors)} image(s) failed: " + "; ".join(errors))
         return rex.succeed(result)
     except Exception as e:
         return rex.fail(e)
+
+
+@bp.get('/process/metrics')
+def process_metrics():
+    """
+    各步骤耗时、跳过次数与处理计划的分布
+    SKIPPABLE步骤的saved为按执行时的平均耗时估计的跳过节省的总时间(秒), 自适应二值化的节省扣除全局阈值的耗时
+    """
+    with _plan_lock:
+        plan_counts, recent, skip_counts = dict(plans), list(recent_plans), dict(skipped)
+    steps = {step: {"time": step_time[step].to_dict()} for step in STEPS}
+    for step in SKIPPABLE:
+        count = skip_counts.get(step, 0)
+        steps[step]["skipped"] = count
+        steps[step]["saved"] = count * steps[step]["time"]["mean"]
+    steps["threshold"]["saved"] = max(0.0, steps["threshold"]["saved"] - step_time["global_threshold"].total)
+    # 去模糊的命中率: 执行去模糊的图片占分析过的图片的比例
+    analyzed = step_time["analyze"].count
+    deblur = {"hit_rate": step_time["deblur"].count / analyzed if analyzed else 0.0, "spectra": spectra.metrics()}
+    return rex.succeed({"steps": steps, "plans": plan_counts, "deblur": deblur, "recent": recent})
@@ -1,19 +1,107 @@
-import numpy as np
+import threading
+from collections import OrderedDict
+
 import cv2
+import numpy as np
+from scipy import fft
 
 """
-频域逆滤波方法
+频域恢复方法
+图片为实数, 使用rfft2只计算一半的频谱, 并将图片反射填充到FFT的快速长度(同时减轻循环卷积的边缘振铃)
+点扩散函数(PSF)的频谱按(核, 尺寸)缓存, 同尺寸的图片不再重复计算
 """
 
+SPECTRUM_CACHE = 16  # 缓存的PSF频谱数量, 超出时淘汰最久未使用的
+
+
+class SpectrumCache:
+    """
+    SpectrumCache PSF频谱缓存
+    以核的内容与填充后的尺寸为键, 值为核中心平移到原点后的rfft2频谱(complex64)
+    """
+
+    def __init__(self, capacity: int = SPECTRUM_CACHE):
+        self.capacity = capacity
+        self._spectra = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, kernel: np.ndarray, shape):
+        key = (kernel.shape, kernel.tobytes(), tuple(shape))
+        with self._lock:
+            spectrum = self._spectra.get(key)
+            if spectrum is not None:
+                self._spectra.move_to_end(key)
+                self.hits += 1
+                return spectrum
+            self.misses += 1
+        # 核放在左上角并循环平移, 使核中心位于原点, 恢复结果不产生位移
+        padded = np.zeros(shape, np.float32)
+        kh, kw = kernel.shape
+        padded[:kh, :kw] = kernel / kernel.sum()
+        padded = np.roll(padded, (-(kh // 2), -(kw // 2)), axis=(0, 1))
+        spectrum = fft.rfft2(padded)
+        with self._lock:
+            self._spectra[key] = spectrum
+            while len(self._spectra) > self.capacity:
+                self._spectra.popitem(last=False)
+        return spectrum
+
+    def metrics(self) -> dict:
+        with self._lock:
+            return {"spectra": len(self._spectra), "hits": self.hits, "misses": self.misses}
+
+
+spectra = SpectrumCache()
+
+
+def gaussian_psf(sigma):
+    """高斯离焦模糊的PSF, 边长覆盖3 sigma"""
+    size = 2 * int(np.ceil(3 * sigma)) + 1
+    g = cv2.getGaussianKernel(size, sigma, cv2.CV_32F)
+    return g @ g.T
+
+
+def pad(img, kernel):
+    """将灰度图反射填充到FFT的快速长度, 返回float32的填充图与原图所在的(top, left)"""
+    h, w = img.shape
+    kh, kw = kernel.shape
+    shape = (fft.next_fast_len(h + kh, real=True), fft.next_fast_len(w + kw, real=True))
+    top, left = kh // 2, kw // 2
+    padded = cv2.copyMakeBorder(img, top, shape[0] - h - top, left, shape[1] - w - left, cv2.BORDER_REFLECT)
+    return padded.astype(np.float32), top, left
+
+
+def restore(img, kernel, make_filter, dst=None):
+    """以make_filter(PSF频谱)得到的频域滤波器恢复灰度图, 结果写入dst(为空时新建)"""
+    padded, top, left = pad(img, kernel)
+    spectrum = spectra.get(kernel, padded.shape)
+    restored = fft.irfft2(fft.rfft2(padded) * make_filter(spectrum), s=padded.shape)
+    h, w = img.shape
+    if dst is None:
+        dst = np.empty((h, w), np.uint8)
+    np.clip(restored[top:top + h, left:left + w], 0, 255, out=restored[top:top + h, left:left + w])
+    dst[:] = restored[top:top + h, left:left + w]
+    return dst
+
+
+def wiener(blurred, kernel, K=0.01, dst=None):
+    """
+    频域维纳滤波: conj(H) / (|H|^2 + K) * G
+    K为噪声与信号的功率比, 越大越平滑
+    """
+    return restore(blurred, kernel, lambda H: np.conj(H) / (H.real ** 2 + H.imag ** 2 + K), dst)
+
 
 def freq_inverse_filter(blurred, kernel, eps=1e-3):
     """
     频域逆滤波：H(u,v)^-1 * G(u,v)
     """
-    G = np.fft.fft2(blurred)
-    H = np.fft.fft2(kernel, s=blurred.shape)
-    H[np.abs(H) < eps] = eps  # 避免除0
-    F_hat = G / H
-    f_hat = np.fft.ifft2(F_hat)
-    restored = np.abs(f_hat)
-    return np.clip(restored, 0, 255).astype(np.uint8)
+
+    def inverse(H):
+        H = H.copy()
+        H[np.abs(H) < eps] = eps  # 避免除0
+        return 1 / H
+
+    return restore(blurred, kernel, inverse)
@@ -2,6 +2,8 @@ import numpy as np
 from scipy.signal import convolve2d
 import cv2
 
+from process.restore.restore_freq import wiener
+
 """
 空域恢复方法
 """
@@ -18,15 +20,6 @@ def inverse_filter(blurred, kernel, epsilon=1e-3):
 
 def wiener_filter(blurred, kernel, K=0.01):
     """
-    空域维纳滤波
+    维纳滤波, 在频域实现, 见restore_freq.wiener
     """
-    kernel /= np.sum(kernel)
-    dummy = np.copy(blurred)
-    dft_blur = np.fft.fft2(blurred)
-    dft_kernel = np.fft.fft2(kernel, s=blurred.shape)
-    dft_kernel_conj = np.conj(dft_kernel)
-    dft_kernel_abs2 = np.abs(dft_kernel) ** 2
-    wiener_filter = dft_kernel_conj / (dft_kernel_abs2 + K)
-    dft_result = wiener_filter * dft_blur
-    result = np.fft.ifft2(dft_result)
-    return np.abs(result).astype(np.uint8)
+    return wiener(blurred, kernel, K)